@@ -5,6 +5,9 @@ set -e
 CONFIG_FILE="/etc/pwnagotchi/config.toml"
 PLUGIN_DIR="/usr/local/share/pwnagotchi/custom-plugins"
 REMOTE_URL="https://raw.githubusercontent.com/wpa-2/TelePwn/refs/heads/main/telepwn.py"
+HELPER_URL="https://raw.githubusercontent.com/wpa-2/TelePwn/refs/heads/main/telepwn_helper.py"
+HELPER_PATH="/usr/local/bin/telepwn-helper"
+HELPER_UNIT="/etc/systemd/system/telepwn-helper.service"
 
 echo "[ + ] Checking internet connection..."
 if ! wget -q --spider http://google.com; then
@@ -53,12 +56,27 @@ if [ $? -ne 0 ]; then
 fi
 chmod +x "$PLUGIN_PATH"
 
-# Create the TOML files for webhooks and schedules with proper permissions.
-echo "[ + ] Creating telepwn_webhooks.toml and telepwn_schedules.toml..."
-sudo touch /etc/pwnagotchi/telepwn_webhooks.toml
-sudo chmod 644 /etc/pwnagotchi/telepwn_webhooks.toml
-sudo touch /etc/pwnagotchi/telepwn_schedules.toml
-sudo chmod 644 /etc/pwnagotchi/telepwn_schedules.toml
+# The helper lives outside the plugin directory so pwnagotchi doesn't load it as a plugin.
+echo "[ + ] Installing TelePwn privileged helper..."
+if wget -O "$HELPER_PATH" "$HELPER_URL"; then
+    chmod 755 "$HELPER_PATH"
+    tee "$HELPER_UNIT" > /dev/null << EOF
+[Unit]
+Description=TelePwn privileged helper
+Before=pwnagotchi.service
+
+[Service]
+ExecStart=/usr/bin/python3 $HELPER_PATH
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+EOF
+    systemctl daemon-reload
+    systemctl enable --now telepwn-helper.service || echo "[ - ] Warning: Failed to start telepwn-helper. TelePwn will fall back to sudo."
+else
+    echo "[ - ] Warning: Failed to download telepwn_helper.py. TelePwn will fall back to sudo."
+fi
 
 echo "[ + ] Backing up config..."
 cp "$CONFIG_FILE" "$CONFIG_FILE.bak"
@@ -1,8 +1,23 @@
 #!/usr/bin/env python3
 import os
+import io
+import sys
+import json
+import mmap
+import hashlib
+import filecmp
+import struct
+import socket
+import shutil
 import logging
 import subprocess
 import threading
+import cProfile
+import pstats
+import tracemalloc
+import tarfile
+import zipfile
+import tempfile
 from time import sleep, time
 import telegram
 import pwnagotchi
@@ -11,27 +26,202 @@ import pwnagotchi.ui.view as view
 import pwnagotchi.plugins as plugins
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import CommandHandler, CallbackQueryHandler, Updater, MessageHandler, Filters
+from telegram.utils.request import Request
 import toml
 import requests
 import psutil  # For system stats
 import schedule  # For scheduled tasks
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
+import sqlite3
+from contextlib import contextmanager
+import secrets
+import random
+import bisect
+import glob
+import html
+import gzip
+from types import SimpleNamespace
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 # Constants
 CONFIG_FILE = "/etc/pwnagotchi/config.toml"
 HANDSHAKE_DIR = "/home/pi/handshakes/"
 MAX_MESSAGE_LENGTH = 4096 // 2
 LOG_PATH = "/etc/pwnagotchi/log/pwnagotchi.log"
-COOLDOWN_SECONDS = 2
+THROTTLE_DEFAULTS = {
+    "nav": {"per_minute": 60, "burst": 10},
+    "read": {"per_minute": 20, "burst": 5},
+    "heavy": {"per_minute": 4, "burst": 1},
+    "power": {"per_minute": 6, "burst": 2},
+}
+ACTION_CLASSES = {
+    "show_menu": "nav",
+    "cancel": "nav",
+    "back_to_initial": "nav",
+    "reboot": "nav",
+    "shutdown": "nav",
+    "plugins": "nav",
+    "plugins_page": "nav",
+    "inbox_page": "nav",
+    "logsearch_page": "nav",
+    "uptime": "read",
+    "handshake_count": "read",
+    "system_stats": "read",
+    "restart_history": "read",
+    "logs": "read",
+    "inbox": "read",
+    "inbox_refresh": "read",
+    "take_screenshot": "heavy",
+    "create_backup": "heavy",
+    "confirm_shell": "heavy",
+    "dedupe_apply": "heavy",
+    "upload_done": "nav",
+    "config_browse": "nav",
+    "config_complete": "nav",
+    "config_view": "read",
+    "config_discard": "nav",
+    "config_apply": "power",
+    "reboot_manual": "power",
+    "reboot_auto": "power",
+    "confirm_shutdown": "power",
+    "restart_manual": "power",
+    "restart_auto": "power",
+    "pwnkill": "power",
+    "clear": "power",
+    "toggle_plugin": "power",
+}
+PROFILE_MAX_SECONDS = 120
+PROFILE_MIN_FREE_MB = 48
+PROFILE_SAMPLE_INTERVAL = 0.01
+PROFILE_TOP_ENTRIES = 40
+PROFILE_TRACE_FRAMES = 5
+PENDING_MAX_ENTRIES = 256
+PENDING_TTL_SECONDS = 600
+UPLOAD_TTL_SECONDS = 300
+UPLOAD_ARCHIVES = (".zip", ".tar.gz", ".tgz", ".tar")
+UPLOAD_MAX_BYTES = 20 * 1024 * 1024  # Bot API download limit
+UPLOAD_MAX_ENTRY_BYTES = 64 * 1024 * 1024
+UPLOAD_MAX_EXTRACTED_BYTES = 256 * 1024 * 1024
+UPLOAD_MAX_ENTRIES = 1000
+UPLOAD_SUMMARY_LIST = 30
+PLUGINS_PER_PAGE = 8
+DISPLAY_REFRESH_WINDOW = 10
+DISPLAY_SETTLE_SECONDS = 5
+CONFIG_PAGE_SIZE = 20
+CONFIG_BUTTONS_PER_PAGE = 12
+CONFIG_VALUE_PREVIEW = 60
+HELPER_SOCKET = "/run/telepwn-helper.sock"
+HELPER_TIMEOUT = 120
+BACKUP_FILES = [
+    "/root/settings.yaml",
+    "/root/client_secrets.json",
+    "/home/pi/handshakes/",
+    "/root/.api-report.json",
+    "/root/.ssh",
+    "/root/.bashrc",
+    "/root/.profile",
+    "/root/peers",
+    "/etc/pwnagotchi/",
+    "/usr/local/share/pwnagotchi/custom-plugins",
+    "/etc/ssh/",
+    "/home/pi/.bashrc",
+    "/home/pi/.profile",
+    "/root/.auto-update",
+    "/home/pi/.wpa_sec_Uploads",
+]
 PLUGIN_DIRS = [
     "/home/pi/.pwn/lib/python3.11/site-packages/pwnagotchi/plugins/default/",
     "/usr/local/share/pwnagotchi/custom-plugins/"
 ]
 
-# Change storage files to TOML for consistency
+# All persistent state lives in one SQLite database
+STATE_DB = "/etc/pwnagotchi/telepwn_state.db"
+# Legacy TOML stores, imported into STATE_DB once and then renamed to *.migrated
 WEBHOOK_FILE = "/etc/pwnagotchi/telepwn_webhooks.toml"
 SCHEDULE_FILE = "/etc/pwnagotchi/telepwn_schedules.toml"
+BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
+RESTART_HISTORY_LIMIT = 20
+
+WATCHDOG_INTERVAL = 15
+WATCHDOG_STALL_SECONDS = 90  # getUpdates long-polls for ~12s, so this is several missed polls
+WATCHDOG_BASE_BACKOFF = 30
+WATCHDOG_MAX_BACKOFF = 900
+WATCHDOG_STOP_TIMEOUT = 10
+UPDATER_WORKERS = 4
+API_STATS_WINDOW = 300
+API_STATS_MAX_CALLS = 2000
+FLEET_POLL_TIMEOUT = 25
+FLEET_DISPATCH_TIMEOUT = 15
+FLEET_MAX_BACKOFF = 300
+# Read-only readings a unit will report to the fleet coordinator; nothing else is executed
+FLEET_COMMANDS = ("status", "uptime", "handshakes", "stats", "mode")
+FLEET_COLUMNS = ("uptime", "handshakes", "crackable", "cpu", "mem", "temp", "mode")
+DASHBOARD_MIN_INTERVAL = 30
+DASHBOARD_MAX_BACKOFF = 900
+
+INBOX_POLL_MIN = 60
+INBOX_POLL_MAX = 1800
+INBOX_PAGE_SIZE = 10
+INBOX_SEEN_LIMIT = 500
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+LOG_TIMESTAMP = re.compile(rb"^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})")
+LOG_INDEX_STRIDE = 64 * 1024
+LOG_SEARCH_MAX_MATCHES = 2000
+LOG_SEARCH_PAGE_SIZE = 25
+LOG_SEARCH_PAGE_CHARS = MAX_MESSAGE_LENGTH - 128  # Leaves room for the header and code fence
+LOG_SEARCH_LINE_CHARS = 300
+LOG_SEARCH_MAX_PAGES = 4
+RELATIVE_TIME = re.compile(r"^(\d+)([smhdw])$")
+PCAP_BYTE_ORDER = {
+    b"\xd4\xc3\xb2\xa1": "<",
+    b"\xa1\xb2\xc3\xd4": ">",
+    b"\x4d\x3c\xb2\xa1": "<",  # nanosecond timestamps
+    b"\xa1\xb2\x3c\x4d": ">",
+}
+PCAPNG_SHB = 0x0A0D0D0A
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_PRISM = 119
+LINKTYPE_RADIOTAP = 127
+LINKTYPE_AVS = 163
+LINKTYPE_PPI = 192
+EAPOL_LLC = b"\xaa\xaa\x03\x00\x00\x00\x88\x8e"
+EAPOL_KEY_MIN = 99  # EAPOL header + key descriptor up to the key data length
+PMKID_KDE = b"\xdd\x14\x00\x0f\xac\x04"
+CAPTURE_EXTENSIONS = (".pcap", ".pcapng", ".cap")
+CAPTURE_PARSER_VERSION = 3  # Bump to re-parse cached captures
+CAPTURE_STATUS = {
+    "crackable": "\u2705",
+    "partial": "\ud83d\udfe1",
+    "empty": "\u26aa",
+    "unreadable": "\u26d4",
+}
+HANDSHAKE_SUMMARY_LIST = 30
+HASH_CHUNK_SIZE = 1024 * 1024
+# /batch command names mapped to the button dispatch table; "read" actions run in parallel
+BATCH_COMMANDS = {
+    "uptime": "uptime",
+    "handshakes": "handshake_count",
+    "stats": "system_stats",
+    "inbox": "inbox",
+    "logs": "logs",
+    "restarts": "restart_history",
+    "screenshot": "take_screenshot",
+    "backup": "create_backup",
+    "clear": "clear",
+    "kill": "pwnkill",
+}
+BATCH_WORKERS = 4
+BATCH_MAX_COMMANDS = 10
+MACRO_NAME = re.compile(r"^[a-z][a-z0-9_]{0,31}$")
+RULE_EVENTS = ("handshake", "captures", "temperature", "memory", "disk_free")
+RULE_SAMPLED_EVENTS = ("temperature", "memory", "disk_free")
+RULE_DEFAULT_COOLDOWN = 300
+RULE_SAMPLE_INTERVAL = 60
+RULE_MIN_SAMPLE_INTERVAL = 10
+RULE_WORKERS = 2
 
 # Initial menu with just a "Menu" button
 INITIAL_MENU = [
@@ -67,6 +257,1201 @@ MAIN_MENU = [
 ]
 
 
+class HelperError(subprocess.CalledProcessError):
+    # Raised for requests the helper rejected, so existing CalledProcessError handling applies
+    def __str__(self):
+        return f"helper {self.cmd} failed: {self.output}"
+
+
+class HelperUnavailable(Exception):
+    # The helper could not be reached at all, so nothing was run and sudo is safe to use
+    pass
+
+
+class HelperClient:
+    # Talks to telepwn_helper.py over its Unix socket, one JSON line per request
+    def __init__(self, socket_path=HELPER_SOCKET, timeout=HELPER_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def available(self):
+        return os.path.exists(self.socket_path)
+
+    def call(self, op, **args):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except (FileNotFoundError, ConnectionRefusedError, PermissionError) as e:
+                raise HelperUnavailable(str(e)) from e
+            sock.sendall(json.dumps({"op": op, "args": args}).encode("utf-8") + b"\n")
+            data = b""
+            while not data.endswith(b"\n"):
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        response = json.loads(data)
+        if not response.get("ok"):
+            raise HelperError(1, op, output=response.get("error"))
+        return response.get("result", {})
+
+
+def parse_pwngrid_inbox(output):
+    # pwngrid prints a box-drawn (or ASCII) table; turn each row into a dict keyed by header
+    rows = []
+    for line in ANSI_ESCAPE.sub("", output).splitlines():
+        if "│" not in line and "|" not in line:
+            continue
+        cells = [cell.strip() for cell in re.split(r"[│|]", line.strip().strip("│|"))]
+        if any(cells):
+            rows.append(cells)
+    if not rows:
+        return []
+    header = [name.lower() or f"col{i}" for i, name in enumerate(rows[0])]
+    messages = []
+    for cells in rows[1:]:
+        record = dict(zip(header, cells))
+        if record.get("id"):
+            messages.append(record)
+    return messages
+
+
+def parse_time_arg(text, now=None):
+    # Accepts 30m/2h/1d/1w, today, yesterday, HH:MM, YYYY-MM-DD or YYYY-MM-DDTHH:MM[:SS]
+    now = now or datetime.now()
+    text = text.strip().lower()
+    match = RELATIVE_TIME.match(text)
+    if match:
+        unit = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}[match.group(2)]
+        return (now - timedelta(**{unit: int(match.group(1))})).timestamp()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if text == "today":
+        return midnight.timestamp()
+    if text == "yesterday":
+        return (midnight - timedelta(days=1)).timestamp()
+    for fmt in ("%Y-%m-%dt%H:%M:%S", "%Y-%m-%dt%H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            pass
+    try:
+        clock = datetime.strptime(text, "%H:%M")
+        return midnight.replace(hour=clock.hour, minute=clock.minute).timestamp()
+    except ValueError:
+        raise ValueError(f"Unrecognised time: {text}")
+
+
+def paginate_lines(lines, max_lines, budget):
+    # Pages fill up to max_lines or the escaped-character budget, whichever comes first,
+    # so each page goes out as one message and keeps its buttons
+    pages, page, used = [], [], 0
+    for line in lines:
+        if len(line) > LOG_SEARCH_LINE_CHARS:
+            line = line[:LOG_SEARCH_LINE_CHARS - 1] + "…"
+        size = len(html.escape(line)) + 1
+        if page and (len(page) >= max_lines or used + size > budget):
+            pages.append(page)
+            page, used = [], 0
+        page.append(line)
+        used += size
+    if page:
+        pages.append(page)
+    return pages
+
+
+def escape_truncated(text, limit):
+    # HTML-escape text, shortening the raw text first so no entity is cut in half
+    escaped = html.escape(text)
+    while len(escaped) > limit:
+        text = text[:len(text) * (limit - 1) // len(escaped)]
+        escaped = html.escape(text) + "…"
+    return escaped
+
+
+def log_line_time(line):
+    match = LOG_TIMESTAMP.match(line)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1).decode("ascii"), "%Y-%m-%d %H:%M:%S").timestamp()
+    except ValueError:
+        return None
+
+
+class LogIndex:
+    # Sparse timestamp -> offset index per log file, so time-bounded searches can seek.
+    # Offsets in .gz files are uncompressed positions; seeking there still streams.
+    def __init__(self, log_path=LOG_PATH):
+        self.log_path = log_path
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def log_files(self):
+        directory, name = os.path.split(self.log_path)
+        stem = name.rsplit(".", 1)[0]
+        paths = set(glob.glob(f"{self.log_path}*")) | set(glob.glob(os.path.join(directory, f"{stem}-*.gz")))
+        return [p for p in paths if os.path.isfile(p)]
+
+    def _open(self, path):
+        return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+    def entry(self, path):
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.files.get(path)
+            grown = (entry and not path.endswith(".gz") and entry["inode"] == stat.st_ino
+                     and stat.st_size >= entry["indexed_to"])
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns and entry["inode"] == stat.st_ino:
+                return entry
+            if not grown:
+                entry = {"points": [], "first": None, "last": None, "indexed_to": 0}
+            entry.update(inode=stat.st_ino, size=stat.st_size, mtime=stat.st_mtime_ns)
+            self._extend(path, entry)
+            self.files[path] = entry
+            return entry
+
+    def _extend(self, path, entry):
+        # Only the live log grows; resume from where indexing stopped last time
+        next_point = entry["indexed_to"]
+        with self._open(path) as f:
+            f.seek(entry["indexed_to"])
+            offset = entry["indexed_to"]
+            for line in f:
+                stamp = log_line_time(line)
+                if stamp is not None:
+                    if entry["first"] is None:
+                        entry["first"] = stamp
+                    entry["last"] = stamp
+                    if offset >= next_point:
+                        entry["points"].append((stamp, offset))
+                        next_point = offset + LOG_INDEX_STRIDE
+                offset += len(line)
+            entry["indexed_to"] = offset
+
+    def search(self, pattern, since=None, until=None, limit=LOG_SEARCH_MAX_MATCHES):
+        # Returns (matches, truncated); files are scanned oldest first
+        entries = []
+        for path in self.log_files():
+            try:
+                entries.append((path, self.entry(path)))
+            except OSError:
+                continue
+        entries.sort(key=lambda item: item[1]["first"] or 0)
+        matches = []
+        for path, entry in entries:
+            if entry["first"] is None:
+                continue
+            if (since and entry["last"] < since) or (until and entry["first"] > until):
+                continue
+            start = 0
+            if since:
+                position = bisect.bisect_right(entry["points"], (since, float("inf"))) - 1
+                if position > 0:
+                    start = entry["points"][position][1]
+            current = None
+            with self._open(path) as f:
+                f.seek(start)
+                for line in f:
+                    stamp = log_line_time(line)
+                    if stamp is not None:
+                        current = stamp
+                    if until and current and current > until:
+                        break
+                    if since and (current is None or current < since):
+                        continue
+                    text = line.decode("utf-8", "replace").rstrip("\n")
+                    if pattern.search(text):
+                        matches.append(f"{os.path.basename(path)}: {text}" if path != self.log_path else text)
+                        if len(matches) >= limit:
+                            return matches, True
+        return matches, False
+
+
+def iter_capture_packets(buf):
+    # Yields (linktype, packet) from a pcap or pcapng buffer and stops at the first truncated record
+    magic = bytes(buf[:4])
+    if magic in PCAP_BYTE_ORDER:
+        order = PCAP_BYTE_ORDER[magic]
+        if len(buf) < 24:
+            return
+        linktype = struct.unpack_from(order + "I", buf, 20)[0]
+        record = struct.Struct(order + "IIII")
+        offset = 24
+        while offset + 16 <= len(buf):
+            incl_len = record.unpack_from(buf, offset)[2]
+            offset += 16
+            if offset + incl_len > len(buf):
+                return
+            yield linktype, buf[offset:offset + incl_len]
+            offset += incl_len
+    elif magic == b"\x0a\x0d\x0d\x0a":
+        order = "<"
+        linktypes = []
+        offset = 0
+        while offset + 12 <= len(buf):
+            # The section header block type reads the same in either byte order
+            block_type = struct.unpack_from(order + "I", buf, offset)[0]
+            if block_type == PCAPNG_SHB:
+                order = "<" if bytes(buf[offset + 8:offset + 12]) == b"\x4d\x3c\x2b\x1a" else ">"
+                linktypes = []
+            block_len = struct.unpack_from(order + "I", buf, offset + 4)[0]
+            if block_len < 12 or block_len % 4 or offset + block_len > len(buf):
+                return
+            body = offset + 8
+            if block_type == 1:
+                linktypes.append(struct.unpack_from(order + "H", buf, body)[0])
+            elif block_type == 6:
+                interface, _, _, cap_len = struct.unpack_from(order + "IIII", buf, body)
+                if interface < len(linktypes) and 20 + cap_len <= block_len - 12:
+                    yield linktypes[interface], buf[body + 20:body + 20 + cap_len]
+            elif block_type == 3 and linktypes:
+                cap_len = min(struct.unpack_from(order + "I", buf, body)[0], block_len - 16)
+                yield linktypes[0], buf[body + 4:body + 4 + cap_len]
+            elif block_type == 2:
+                interface, _, _, _, cap_len = struct.unpack_from(order + "HHIII", buf, body)
+                if interface < len(linktypes) and 20 + cap_len <= block_len - 12:
+                    yield linktypes[interface], buf[body + 20:body + 20 + cap_len]
+            offset += block_len
+    else:
+        raise ValueError("not a pcap or pcapng file")
+
+
+def ieee80211_frame(linktype, packet):
+    # Strips the capture header in front of the 802.11 frame
+    try:
+        if linktype == LINKTYPE_IEEE802_11:
+            return packet
+        if linktype == LINKTYPE_RADIOTAP:
+            return packet[struct.unpack_from("<H", packet, 2)[0]:]
+        if linktype == LINKTYPE_PPI:
+            if struct.unpack_from("<I", packet, 4)[0] != LINKTYPE_IEEE802_11:
+                return None
+            return packet[struct.unpack_from("<H", packet, 2)[0]:]
+        if linktype == LINKTYPE_PRISM:
+            return packet[struct.unpack_from("<I", packet, 4)[0]:]
+        if linktype == LINKTYPE_AVS:
+            return packet[struct.unpack_from(">I", packet, 4)[0]:]
+    except struct.error:
+        pass
+    return None
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def format_mac(raw):
+    return ":".join(f"{b:02x}" for b in raw)
+
+
+def _capture_essid(frame, offset):
+    # Walks the tagged parameters for the SSID element
+    while offset + 2 <= len(frame):
+        tag, length = frame[offset], frame[offset + 1]
+        if tag == 0:
+            essid = frame[offset + 2:offset + 2 + length]
+            return essid if essid.strip(b"\x00") else None
+        offset += 2 + length
+    return None
+
+
+def empty_capture(status="empty", error=None):
+    return {"status": status, "essid": None, "bssid": None, "handshakes": 0, "pmkid": False, "eapol": 0, "networks": 0, "error": error, "hashes": []}
+
+
+def parse_capture(path):
+    # Reads a capture through mmap and reports networks, EAPOL messages, PMKIDs and hashcat 22000 lines
+    networks = {}
+
+    def network(bssid):
+        return networks.setdefault(bssid, {"essid": None, "pmkids": {}, "eapol": 0, "stations": {}})
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return empty_capture()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for linktype, packet in iter_capture_packets(buf):
+                frame = ieee80211_frame(linktype, packet)
+                if frame is None or len(frame) < 24:
+                    continue
+                fc, flags = frame[0], frame[1]
+                frame_type, subtype = (fc >> 2) & 3, fc >> 4
+                if frame_type == 0 and subtype in (0, 2, 5, 8):
+                    # Association/reassociation requests, probe responses and beacons carry the SSID
+                    fixed = {0: 4, 2: 10, 5: 12, 8: 12}[subtype]
+                    essid = _capture_essid(frame, 24 + fixed)
+                    if essid:
+                        network(frame[16:22])["essid"] = essid
+                    continue
+                if frame_type != 2 or flags & 0x40:
+                    continue
+                ds = flags & 3
+                if ds == 3:
+                    continue
+                header = 24
+                if subtype & 8:
+                    header += 6 if flags & 0x80 else 2
+                if frame[header:header + 8] != EAPOL_LLC:
+                    continue
+                eapol = frame[header + 8:]
+                if len(eapol) < EAPOL_KEY_MIN or eapol[1] != 3:
+                    continue
+                eapol = eapol[:4 + struct.unpack_from(">H", eapol, 2)[0]]
+                if len(eapol) < EAPOL_KEY_MIN:
+                    continue
+                key_info = struct.unpack_from(">H", eapol, 5)[0]
+                if not key_info & 0x0008:
+                    continue  # Group key handshake
+                if ds == 2:
+                    bssid, station = frame[10:16], frame[4:10]
+                elif ds == 1:
+                    bssid, station = frame[4:10], frame[10:16]
+                else:
+                    bssid, station = frame[16:22], frame[10:16]
+                ack, mic, secure = key_info & 0x0080, key_info & 0x0100, key_info & 0x0200
+                nonce = eapol[17:49]
+                if ack:
+                    message = 3 if mic else 1
+                elif mic:
+                    message = 4 if secure or not nonce.strip(b"\x00") else 2
+                else:
+                    continue
+                replay = struct.unpack_from(">Q", eapol, 9)[0]
+                entry = network(bssid)
+                entry["eapol"] += 1
+                messages = entry["stations"].setdefault(station, {})
+                if message in (1, 3):
+                    messages[(message, replay)] = nonce
+                elif message == 2:
+                    # hashcat wants the M2 frame with its MIC zeroed, plus the MIC itself
+                    messages[(message, replay)] = (eapol[81:97], eapol[:81] + b"\x00" * 16 + eapol[97:])
+                else:
+                    messages[(message, replay)] = None
+                if message == 1:
+                    key_data = eapol[EAPOL_KEY_MIN:EAPOL_KEY_MIN + struct.unpack_from(">H", eapol, 97)[0]]
+                    index = key_data.find(PMKID_KDE)
+                    pmkid = key_data[index + 6:index + 22] if index >= 0 else b""
+                    if len(pmkid) == 16 and pmkid.strip(b"\x00"):
+                        entry["pmkids"][(pmkid, station)] = True
+
+    best = None
+    hashes = []
+    for bssid, entry in networks.items():
+        # A usable pair is M2 with the M1 of the same replay counter (message pair 00)
+        # or the M3 that follows it (message pair 02)
+        entry["handshakes"] = 0
+        essid_hex = entry["essid"].hex() if entry["essid"] else None
+        for station, messages in entry["stations"].items():
+            for (message, replay), data in messages.items():
+                if message != 2:
+                    continue
+                if (1, replay) in messages:
+                    anonce, pair = messages[(1, replay)], "00"
+                elif (3, replay + 1) in messages:
+                    anonce, pair = messages[(3, replay + 1)], "02"
+                else:
+                    continue
+                entry["handshakes"] += 1
+                if essid_hex:
+                    mic, frame = data
+                    hashes.append(f"WPA*02*{mic.hex()}*{bssid.hex()}*{station.hex()}*{essid_hex}*{anonce.hex()}*{frame.hex()}*{pair}")
+        if essid_hex:
+            hashes.extend(f"WPA*01*{pmkid.hex()}*{bssid.hex()}*{station.hex()}*{essid_hex}***" for pmkid, station in entry["pmkids"])
+        rank = (entry["handshakes"] > 0 or bool(entry["pmkids"]), entry["eapol"] > 0, entry["essid"] is not None)
+        if best is None or rank > best[0]:
+            best = (rank, bssid, entry)
+    if best is None:
+        return empty_capture()
+    _, bssid, entry = best
+    if entry["handshakes"] or entry["pmkids"]:
+        status = "crackable"
+    elif entry["eapol"]:
+        status = "partial"
+    else:
+        status = "empty"
+    return {
+        "status": status,
+        "essid": entry["essid"].decode("utf-8", errors="replace") if entry["essid"] else None,
+        "bssid": format_mac(bssid),
+        "handshakes": entry["handshakes"],
+        "pmkid": bool(entry["pmkids"]),
+        "eapol": entry["eapol"],
+        "networks": len(networks),
+        "error": None,
+        "hashes": list(dict.fromkeys(hashes)),
+    }
+
+
+class CaptureCatalog:
+    # Parse results cached in the state store, keyed by path, size and mtime
+    def __init__(self, store, directory=HANDSHAKE_DIR):
+        self.logger = logging.getLogger("TelePwn")
+        self.store = store
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        with self.lock:
+            cached = self.store.captures()
+            current = {}
+            parsed = []
+            for entry in os.scandir(self.directory):
+                if not entry.is_file() or not entry.name.lower().endswith(CAPTURE_EXTENSIONS):
+                    continue
+                stat = entry.stat()
+                row = cached.get(entry.path)
+                if row and row["size"] == stat.st_size and row["mtime"] == stat.st_mtime_ns and row["parser"] == CAPTURE_PARSER_VERSION:
+                    current[entry.path] = row
+                    continue
+                try:
+                    info = parse_capture(entry.path)
+                except (OSError, ValueError, struct.error) as e:
+                    self.logger.warning(f"[TelePwn] Could not parse {entry.path}: {e}")
+                    info = empty_capture("unreadable", str(e))
+                try:
+                    sha256 = file_sha256(entry.path)
+                except OSError:
+                    sha256 = None
+                row = dict(info, path=entry.path, size=stat.st_size, mtime=stat.st_mtime_ns, parser=CAPTURE_PARSER_VERSION, sha256=sha256)
+                current[entry.path] = row
+                parsed.append(row)
+            stale = [path for path in cached if path not in current]
+            if parsed or stale:
+                with self.store.transaction():
+                    self.store.put_captures(parsed)
+                    self.store.delete_captures(stale)
+                self.logger.info(f"[TelePwn] Capture catalog: parsed {len(parsed)}, dropped {len(stale)}, cached {len(current) - len(parsed)}")
+            return current
+
+    def duplicates(self):
+        # Groups of byte-identical captures, oldest first; the first file is the one to keep.
+        # Each file is (st_nlink, rows) with every catalogued name hard-linked to that inode,
+        # so names of one inode are not copies of each other.
+        groups = {}
+        for row in self.refresh().values():
+            if row["sha256"]:
+                groups.setdefault(row["sha256"], []).append(row)
+        duplicates = []
+        for rows in groups.values():
+            if len(rows) < 2:
+                continue
+            files = {}
+            for row in sorted(rows, key=lambda row: (row["mtime"], row["path"])):
+                try:
+                    stat = os.stat(row["path"])
+                except OSError:
+                    continue
+                files.setdefault((stat.st_dev, stat.st_ino), (stat.st_nlink, []))[1].append(row)
+            if len(files) > 1:
+                duplicates.append(list(files.values()))
+        return duplicates
+
+
+class StateStore:
+    # Single SQLite database in WAL mode. Writes are per row and transactional, so nothing
+    # rewrites whole files; synchronous=NORMAL keeps fsyncs (and SD card wear) down.
+    def __init__(self, path=STATE_DB):
+        self.logger = logging.getLogger("TelePwn")
+        self.path = path
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("PRAGMA wal_autocheckpoint=256")
+        self.migrate()
+
+    @contextmanager
+    def transaction(self):
+        # Nested calls on the same thread join the outer transaction
+        with self.lock:
+            if self.depth:
+                self.depth += 1
+                try:
+                    yield self.conn
+                finally:
+                    self.depth -= 1
+                return
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.depth = 1
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            else:
+                self.conn.execute("COMMIT")
+            finally:
+                self.depth = 0
+
+    def migrate(self):
+        migrations = [self._create_tables, self._import_toml, self._create_captures, self._add_capture_hashes, self._add_capture_sha256]
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(migrations[version:], version + 1):
+            with self.transaction() as conn:
+                retired = migration(conn)
+                conn.execute(f"PRAGMA user_version={number}")
+            self.logger.info(f"[TelePwn] State store migrated to schema version {number}")
+            # Source files are only renamed once their rows are committed; a rolled-back import leaves them in place
+            for path in retired or ():
+                try:
+                    os.replace(path, f"{path}.migrated")
+                except OSError as e:
+                    self.logger.warning(f"[TelePwn] Imported {path} but could not rename it: {e}")
+
+    def _create_tables(self, conn):
+        conn.execute("CREATE TABLE webhooks (name TEXT PRIMARY KEY, config TEXT NOT NULL)")
+        conn.execute("CREATE TABLE schedules (id INTEGER PRIMARY KEY AUTOINCREMENT, action TEXT NOT NULL, interval INTEGER NOT NULL, created_at REAL NOT NULL)")
+        conn.execute("CREATE TABLE kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)")
+
+    def _import_toml(self, conn):
+        legacy = {}
+        for path in (WEBHOOK_FILE, SCHEDULE_FILE):
+            try:
+                if os.path.exists(path) and os.path.getsize(path) > 0:
+                    with open(path, "r", encoding="utf-8") as f:
+                        legacy[path] = toml.load(f)
+            except Exception as e:
+                self.logger.error(f"[TelePwn] Skipping unreadable {path}: {e}")
+        for name, config in legacy.get(WEBHOOK_FILE, {}).items():
+            conn.execute("INSERT OR REPLACE INTO webhooks (name, config) VALUES (?, ?)", (name, json.dumps(config)))
+        for task_id, task in legacy.get(SCHEDULE_FILE, {}).items():
+            # Keep the old IDs so users' /schedule remove commands still match
+            conn.execute("INSERT INTO schedules (id, action, interval, created_at) VALUES (?, ?, ?, ?)",
+                         (int(task_id), task["action"], int(task["interval"]), time()))
+        if legacy:
+            self.logger.info(f"[TelePwn] Imported legacy state from {', '.join(legacy)}")
+        return list(legacy)
+
+    def _create_captures(self, conn):
+        conn.execute(
+            "CREATE TABLE captures (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL, parser INTEGER NOT NULL, "
+            "status TEXT NOT NULL, essid TEXT, bssid TEXT, handshakes INTEGER NOT NULL, pmkid INTEGER NOT NULL, "
+            "eapol INTEGER NOT NULL, networks INTEGER NOT NULL, error TEXT, parsed_at REAL NOT NULL)"
+        )
+
+    def _add_capture_hashes(self, conn):
+        # Newline-separated hashcat 22000 lines; NULL until the capture is parsed again
+        conn.execute("ALTER TABLE captures ADD COLUMN hashes TEXT")
+
+    def _add_capture_sha256(self, conn):
+        conn.execute("ALTER TABLE captures ADD COLUMN sha256 TEXT")
+        conn.execute("CREATE INDEX captures_sha256 ON captures (sha256)")
+
+    def webhooks(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT name, config FROM webhooks ORDER BY name").fetchall()
+        return {name: json.loads(config) for name, config in rows}
+
+    def put_webhook(self, name, config):
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO webhooks (name, config) VALUES (?, ?)", (name, json.dumps(config)))
+
+    def delete_webhook(self, name):
+        with self.transaction() as conn:
+            return conn.execute("DELETE FROM webhooks WHERE name = ?", (name,)).rowcount > 0
+
+    def schedules(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT id, action, interval FROM schedules ORDER BY id").fetchall()
+        return {str(task_id): {"action": action, "interval": interval} for task_id, action, interval in rows}
+
+    def add_schedule(self, action, interval):
+        # AUTOINCREMENT never reuses IDs, even after removals
+        with self.transaction() as conn:
+            cursor = conn.execute("INSERT INTO schedules (action, interval, created_at) VALUES (?, ?, ?)", (action, interval, time()))
+            return str(cursor.lastrowid)
+
+    def remove_schedule(self, task_id):
+        with self.transaction() as conn:
+            return conn.execute("DELETE FROM schedules WHERE id = ?", (int(task_id),)).rowcount > 0
+
+    def captures(self):
+        with self.lock:
+            cursor = self.conn.execute("SELECT path, size, mtime, parser, status, essid, bssid, handshakes, pmkid, eapol, networks, error, sha256 FROM captures")
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        for row in rows:
+            row["pmkid"] = bool(row["pmkid"])
+        return {row["path"]: row for row in rows}
+
+    def put_captures(self, rows):
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO captures (path, size, mtime, parser, status, essid, bssid, handshakes, pmkid, eapol, networks, error, hashes, sha256, parsed_at) "
+                "VALUES (:path, :size, :mtime, :parser, :status, :essid, :bssid, :handshakes, :pmkid, :eapol, :networks, :error, :hashes, :sha256, :parsed_at)",
+                [dict(row, pmkid=int(row["pmkid"]), hashes="\n".join(row["hashes"]), parsed_at=time()) for row in rows],
+            )
+
+    def capture_hashes(self, since_ns=0):
+        # Yields (path, lines) one capture at a time, oldest first
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, hashes FROM captures WHERE mtime >= ? AND hashes IS NOT NULL AND hashes != '' ORDER BY mtime", (since_ns,)
+            ).fetchall()
+        for path, hashes in rows:
+            yield path, hashes.split("\n")
+
+    def delete_captures(self, paths):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM captures WHERE path = ?", [(path,) for path in paths])
+
+    def get(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, updated_at) VALUES (?, ?, ?)", (key, json.dumps(value), time()))
+
+    def delete(self, key):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                self.conn.close()
+
+
+class ConfigIndex:
+    # Flattened, sorted dotted keys of config.toml; rebuilt only when the file changes
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self.signature = None
+        self.values = {}
+        self.keys = []
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if signature != self.signature:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    config = toml.load(f)
+                values = {}
+                self._flatten(config, "", values)
+                self.values = values
+                self.keys = sorted(values)
+                self.signature = signature
+        return self
+
+    def _flatten(self, value, prefix, out):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                self._flatten(child, f"{prefix}.{key}" if prefix else str(key), out)
+        elif prefix:
+            out[prefix] = value
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def conflict(self, key):
+        # The key a set would clobber: a value sitting where a section is needed, or the section itself
+        parts = key.split(".")
+        for i in range(1, len(parts)):
+            parent = ".".join(parts[:i])
+            if parent in self.values:
+                return parent
+        if self.with_prefix(f"{key}."):
+            return key
+        return None
+
+    def find(self, text):
+        text = text.lower()
+        return [key for key in self.keys if text in key.lower()]
+
+    def with_prefix(self, prefix):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + "\uffff")
+        return self.keys[start:end]
+
+    def children(self, section):
+        # Direct subsections and leaf keys below a dotted section ("" for the root)
+        prefix = f"{section}." if section else ""
+        subsections, leaves = [], []
+        for key in self.with_prefix(prefix):
+            rest = key[len(prefix):]
+            if "." in rest:
+                head = prefix + rest.split(".", 1)[0]
+                if not subsections or subsections[-1] != head:
+                    subsections.append(head)
+            else:
+                leaves.append(key)
+        return subsections, leaves
+
+    def complete(self, prefix):
+        # Next dotted segment for every key starting with prefix, marked leaf or not
+        completions = []
+        for key in self.with_prefix(prefix):
+            cut = key.find(".", len(prefix))
+            candidate = key if cut == -1 else key[:cut]
+            leaf = cut == -1
+            if not completions or completions[-1][0] != candidate:
+                completions.append((candidate, leaf))
+        return completions
+
+
+class PendingActionStore:
+    # Keeps button payloads server-side; callback_data only carries a short token
+    def __init__(self, max_entries=PENDING_MAX_ENTRIES, ttl=PENDING_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"created": 0, "used": 0, "expired": 0, "evicted": 0, "rejected": 0}
+
+    def put(self, chat_id, kind, payload=None, ttl=None, single_use=True):
+        now = time()
+        with self.lock:
+            self._purge(now)
+            token = secrets.token_urlsafe(6)
+            while token in self.entries:
+                token = secrets.token_urlsafe(6)
+            self.entries[token] = {
+                "chat_id": chat_id,
+                "kind": kind,
+                "payload": payload,
+                "expires": now + (ttl or self.ttl),
+                "single_use": single_use,
+            }
+            self.counters["created"] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evicted"] += 1
+            return token
+
+    def take(self, chat_id, token):
+        # Returns (kind, payload) or None for unknown, expired or foreign tokens
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            if entry["chat_id"] != chat_id:
+                self.counters["rejected"] += 1
+                return None
+            if entry["expires"] < time():
+                del self.entries[token]
+                self.counters["expired"] += 1
+                return None
+            if entry["single_use"]:
+                del self.entries[token]
+            else:
+                self.entries.move_to_end(token)
+            self.counters["used"] += 1
+            return entry["kind"], entry["payload"]
+
+    def peek(self, chat_id, token):
+        # Kind of a live token without consuming it
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None or entry["chat_id"] != chat_id or entry["expires"] < time():
+                return None
+            return entry["kind"]
+
+    def payload_key(self, chat_id, token):
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None or entry["chat_id"] != chat_id:
+                return None
+            payload = entry["payload"]
+            try:
+                hash(payload)
+                return payload
+            except TypeError:
+                return repr(payload)
+
+    def find(self, chat_id, kind):
+        # Latest live token of a kind for a chat, e.g. an upload wait
+        with self.lock:
+            self._purge(time())
+            for token in reversed(self.entries):
+                entry = self.entries[token]
+                if entry["chat_id"] == chat_id and entry["kind"] == kind:
+                    return token
+            return None
+
+    def touch(self, chat_id, token, ttl=None):
+        # Pushes back the expiry of a live multi-use token, e.g. an upload session
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is not None and entry["chat_id"] == chat_id:
+                entry["expires"] = time() + (ttl or self.ttl)
+
+    def discard(self, chat_id, kind):
+        with self.lock:
+            for token in [t for t, e in self.entries.items() if e["chat_id"] == chat_id and e["kind"] == kind]:
+                del self.entries[token]
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, live=len(self.entries))
+
+    def _purge(self, now):
+        for token in [t for t, e in self.entries.items() if e["expires"] < now]:
+            del self.entries[token]
+            self.counters["expired"] += 1
+
+
+class DisplayCoordinator:
+    # Merges TelePwn's e-ink changes and applies them at most once per refresh window, unforced,
+    # so the agent's own UI loop isn't fighting full refreshes on every capture
+    def __init__(self, window=DISPLAY_REFRESH_WINDOW):
+        self.window = window
+        self.pending = {}
+        self.view = None
+        self.timer = None
+        self.last_applied = 0
+        self.lock = threading.Lock()
+
+    def set(self, display, key, value):
+        with self.lock:
+            self.view = display
+            previous, repeats = self.pending.get(key, (None, 0))
+            self.pending[key] = (value, repeats + 1 if previous == value else 1)
+            if self.timer is None:
+                delay = max(0, self.last_applied + self.window - time())
+                self.timer = threading.Timer(delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            display, self.timer = self.view, None
+            self.last_applied = time()
+        if not pending or display is None:
+            return
+        try:
+            for key, (value, repeats) in pending.items():
+                display.set(key, f"{value} (x{repeats})" if repeats > 1 else value)
+            display.update()
+        except Exception as e:
+            logging.getLogger("TelePwn").error(f"[TelePwn] Display update failed: {e}")
+
+    def cancel(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            self.pending = {}
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time()
+        self.lock = threading.Lock()
+
+    def consume(self):
+        with self.lock:
+            now = time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class ActionThrottle:
+    # One token bucket per action class, plus tracking of in-flight jobs so duplicates merge
+    def __init__(self, limits):
+        self.buckets = {name: TokenBucket(limit["per_minute"], limit["burst"]) for name, limit in limits.items()}
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = {}
+
+    def allow(self, action_class):
+        bucket = self.buckets.get(action_class)
+        if bucket is None or bucket.consume():
+            return True
+        with self.lock:
+            self.hits[action_class] = self.hits.get(action_class, 0) + 1
+        return False
+
+    def begin(self, key):
+        # False means an identical job is already running and this request was attached to it
+        with self.lock:
+            if key in self.inflight:
+                self.inflight[key] += 1
+                return False
+            self.inflight[key] = 0
+            return True
+
+    def end(self, key):
+        with self.lock:
+            return self.inflight.pop(key, 0)
+
+
+class RulesEngine:
+    # [[main.plugins.telepwn.rules]] compiled once into predicates and indexed by event name
+    def __init__(self, specs=()):
+        self.rules = []
+        self.by_event = {}
+        self.errors = []
+        self.lock = threading.Lock()
+        for index, spec in enumerate(specs):
+            try:
+                rule = self.compile(spec, index)
+            except (TypeError, ValueError, re.error) as e:
+                self.errors.append(f"rule {index + 1}: {e}")
+                continue
+            self.rules.append(rule)
+            self.by_event.setdefault(rule["event"], []).append(rule)
+
+    def compile(self, spec, index):
+        if not isinstance(spec, dict):
+            raise ValueError("must be a table")
+        event = spec.get("event")
+        if event not in RULE_EVENTS:
+            raise ValueError(f"unknown event {event!r}, use one of {', '.join(RULE_EVENTS)}")
+        action = str(spec.get("action", "")).strip()
+        kind, _, target = action.partition(":")
+        if kind == "command" and target not in BATCH_COMMANDS:
+            raise ValueError(f"unknown command {target!r}, use one of {', '.join(BATCH_COMMANDS)}")
+        if kind == "webhook" and not target:
+            raise ValueError("webhook actions need a name: webhook:<action>")
+        if kind not in ("notify", "command", "webhook"):
+            raise ValueError("action must be notify, command:<name> or webhook:<action>")
+
+        checks = []
+        if event == "handshake":
+            summary = "handshake"
+            if "essid" in spec:
+                essid = re.compile(str(spec["essid"]), re.IGNORECASE)
+                checks.append(lambda data: essid.search(data["essid"]) is not None)
+                summary += f" essid ~ {essid.pattern}"
+            if "bssid" in spec:
+                # A full MAC or just its OUI prefix
+                bssid = str(spec["bssid"]).lower()
+                checks.append(lambda data: data["bssid"].lower().startswith(bssid))
+                summary += f" bssid {bssid}"
+        elif event == "captures":
+            count = int(spec.get("count", 0))
+            window = float(spec.get("minutes", 0)) * 60
+            if count < 2 or window <= 0:
+                raise ValueError("captures needs count >= 2 and minutes > 0")
+            # The last N capture times are all that is needed to know if N landed within the window
+            recent = deque(maxlen=count)
+
+            def burst(data):
+                recent.append(data["at"])
+                return len(recent) == count and recent[-1] - recent[0] <= window
+            checks.append(burst)
+            summary = f"{count} captures in {window / 60:g} min"
+        elif event == "disk_free":
+            if "below" not in spec:
+                raise ValueError("disk_free needs below = <MB>")
+            limit = float(spec["below"])
+            checks.append(lambda data: data["value"] < limit)
+            summary = f"disk free < {limit:g} MB"
+        else:
+            if "above" not in spec:
+                raise ValueError(f"{event} needs above = <number>")
+            limit = float(spec["above"])
+            checks.append(lambda data: data["value"] > limit)
+            summary = f"{event} > {limit:g}{'°C' if event == 'temperature' else '%'}"
+
+        return {
+            "name": str(spec.get("name") or f"rule{index + 1}"),
+            "event": event,
+            "action": action,
+            "kind": kind,
+            "target": target,
+            "extra": str(spec.get("extra", "")),
+            "message": str(spec.get("message", "")),
+            "cooldown": max(0.0, float(spec.get("cooldown", RULE_DEFAULT_COOLDOWN))),
+            "summary": summary,
+            "predicate": checks[0] if len(checks) == 1 else (lambda data: all(check(data) for check in checks)),
+            "last": None,
+            "fired": 0,
+            "suppressed": 0,
+        }
+
+    def emit(self, event, data):
+        # Only this event's rules are looked at; the caller runs the actions off the hook thread
+        fired = []
+        with self.lock:
+            for rule in self.by_event.get(event, ()):
+                if not rule["predicate"](data):
+                    continue
+                if rule["last"] is not None and data["at"] - rule["last"] < rule["cooldown"]:
+                    rule["suppressed"] += 1
+                    continue
+                rule["last"] = data["at"]
+                rule["fired"] += 1
+                fired.append(rule)
+        return fired
+
+    def sampled(self):
+        return [event for event in RULE_SAMPLED_EVENTS if event in self.by_event]
+
+    def find(self, name):
+        return next((rule for rule in self.rules if rule["name"] == name), None)
+
+
+class PollingMonitor:
+    # Bot API call outcomes and polling health, shared by the watchdog and /perf
+    def __init__(self, window=API_STATS_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.calls = deque(maxlen=API_STATS_MAX_CALLS)  # (finished, endpoint, seconds, error name or None)
+        self.last_poll_ok = time()
+        self.stalled_since = None
+        self.restart_attempts = 0
+        self.reconnects = 0
+        self.recoveries = deque(maxlen=20)
+
+    def record(self, endpoint, started, error=None):
+        now = time()
+        with self.lock:
+            self.calls.append((now, endpoint, now - started, type(error).__name__ if error else None))
+            if endpoint == "getUpdates" and error is None:
+                self.last_poll_ok = now
+                if self.stalled_since is not None:
+                    self.recoveries.append(now - self.stalled_since)
+                    self.stalled_since = None
+                    self.restart_attempts = 0
+
+    def idle(self):
+        return time() - self.last_poll_ok
+
+    def stall(self):
+        # Called by the watchdog before each restart; returns the attempt number
+        with self.lock:
+            if self.stalled_since is None:
+                self.stalled_since = self.last_poll_ok
+            self.restart_attempts += 1
+            self.reconnects += 1
+            return self.restart_attempts
+
+    def stats(self):
+        cutoff = time() - self.window
+        with self.lock:
+            recent = [call for call in self.calls if call[0] >= cutoff]
+            recoveries = list(self.recoveries)
+            stalled_since = self.stalled_since
+        errors = {}
+        for call in recent:
+            if call[3]:
+                errors[call[3]] = errors.get(call[3], 0) + 1
+        latencies = sorted(call[2] for call in recent if call[1] != "getUpdates")
+        return {
+            "calls": len(recent),
+            "errors": errors,
+            "polls": sum(1 for call in recent if call[1] == "getUpdates"),
+            "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+            "latency_max": latencies[-1] if latencies else None,
+            "reconnects": self.reconnects,
+            "recoveries": recoveries,
+            "stalled_for": time() - stalled_since if stalled_since is not None else None,
+        }
+
+
+class MonitoredBot(telegram.Bot):
+    # Times every Bot API request, including the updater's getUpdates long-polls
+    def __init__(self, token, monitor, **kwargs):
+        super().__init__(token, **kwargs)
+        self.monitor = monitor
+
+    def _post(self, endpoint, *args, **kwargs):
+        started = time()
+        try:
+            result = super()._post(endpoint, *args, **kwargs)
+        except telegram.error.TelegramError as e:
+            self.monitor.record(endpoint, started, e)
+            raise
+        self.monitor.record(endpoint, started)
+        return result
+
+
+class FleetClient:
+    # Unit side of fleet mode: long-polls the coordinator for jobs and answers them with local readings
+    def __init__(self, url, unit, token, reader):
+        self.logger = logging.getLogger("TelePwn")
+        self.url = url.rstrip("/")
+        self.unit = unit
+        self.reader = reader
+        self.token = token
+        # requests.Session isn't thread-safe: the long-poll thread and each dispatch handler get their own
+        self.local = threading.local()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.logger.info(f"[TelePwn] Fleet unit {self.unit} polling {self.url}")
+
+    def stop(self, timeout=5):
+        # A long-poll in progress only notices the event when it returns; don't wait for the full poll
+        self.stop_event.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=timeout)
+            if self.thread.is_alive():
+                self.logger.warning("[TelePwn] Fleet poller still waiting on the coordinator; it will exit after this poll")
+        self.thread = None
+
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            session.headers["X-Fleet-Token"] = self.token
+        return session
+
+    def run(self):
+        results = []
+        failures = 0
+        while not self.stop_event.is_set():
+            try:
+                response = self.session().post(f"{self.url}/poll", json={"unit": self.unit, "results": results, "timeout": FLEET_POLL_TIMEOUT}, timeout=FLEET_POLL_TIMEOUT + 10)
+                response.raise_for_status()
+                jobs = response.json().get("jobs", [])
+            except (requests.RequestException, ValueError) as e:
+                failures += 1
+                delay = min(FLEET_MAX_BACKOFF, 2 ** failures) * random.uniform(0.5, 1.5)
+                self.logger.warning(f"[TelePwn] Fleet coordinator unreachable ({e}), retrying in {delay:.0f}s")
+                self.stop_event.wait(delay)
+                continue
+            # Results are only dropped once the coordinator has accepted them
+            results = [self.run_job(job) for job in jobs]
+            failures = 0
+
+    def run_job(self, job):
+        command = job.get("command")
+        try:
+            if command not in FLEET_COMMANDS:
+                raise ValueError(f"command not allowed: {command}")
+            return {"id": job.get("id"), "ok": True, "result": self.reader(command)}
+        except Exception as e:
+            return {"id": job.get("id"), "ok": False, "error": str(e)}
+
+    def dispatch(self, command, targets, timeout=FLEET_DISPATCH_TIMEOUT):
+        response = self.session().post(f"{self.url}/dispatch", json={"command": command, "targets": targets, "timeout": timeout}, timeout=timeout + 10)
+        response.raise_for_status()
+        return response.json()["results"]
+
+    def units(self):
+        response = self.session().get(f"{self.url}/units", timeout=10)
+        response.raise_for_status()
+        return response.json()["units"]
+
+
 class TelePwn(plugins.Plugin):
     __author__ = "WPA2"
     __version__ = "0.1.0_Beta"
@@ -84,62 +1469,90 @@ class TelePwn(plugins.Plugin):
             "bot_token": "",
             "chat_id": "",
             "auto_start": True,
-            "send_message": True
+            "send_message": True,
+            "profiling": False,
+            "helper_socket": HELPER_SOCKET,
+            "inbox_poll": True,
+            "inbox_notify": True,
+            "dashboard": False,
+            "dashboard_interval": 120
         }
         self.screen_rotation = 0
         self.updater = None
         self.plugin_states = {}
+        self.store = self._open_store()
         self.webhooks = self._load_webhooks()
         self.schedules = self._load_schedules()
         self.last_plugin_list = []
         self.schedule_thread = None
+        self.schedule_wake = threading.Event()
         self.running = False
-        self.user_states = {}  # Track user states (e.g., waiting for upload)
+        self.pending = PendingActionStore()  # Tokens for buttons and upload waits
+        self.capture = threading.local()  # Reply buffer while a /batch job runs
+        self.throttle = ActionThrottle(THROTTLE_DEFAULTS)
+        self.config_index = ConfigIndex()
+        self.config_lock = threading.Lock()  # Serializes read-modify-write of config.toml
+        self.config_edits = {}  # chat_id -> {dotted key: staged value}
+        self.log_index = LogIndex()
+        self.captures = CaptureCatalog(self.store)
+        self.upload_lock = threading.Lock()
+        self.monitor = PollingMonitor()
+        self.bot_lock = threading.RLock()
+        self.watchdog_thread = None
+        self.watchdog_stop = threading.Event()
+        self.polling_started = 0
+        self.fleet = None
+        self.rules = RulesEngine()
+        self.rules_pool = None
+        self.rules_thread = None
+        self.rules_stop = threading.Event()
+        self.rules_sample = {}
+        self.agent = None
+        self.display = DisplayCoordinator()
+        self.restart_lock = threading.Lock()
+        self.last_capture = None
+        self.dashboard_thread = None
+        self.dashboard_running = False
+        self.dashboard_wake = threading.Event()
+        self.dashboard_message_id = None
+        self.dashboard_text = None
+        self.profile_lock = threading.Lock()
+        self.mem_snapshot = None
+        self.helper = HelperClient()
+        self.inbox_messages = []
+        self.inbox_fetched_at = None
+        self.inbox_seen = None
+        self.inbox_lock = threading.Lock()
+        self.inbox_wake = threading.Event()
+        self.inbox_thread = None
+        self.inbox_running = False
+
+    def _open_store(self):
+        try:
+            return StateStore(STATE_DB)
+        except Exception as e:
+            # Keep working (without persistence) rather than failing to load
+            self.logger.error(f"[TelePwn] Failed to open {STATE_DB}, using in-memory state: {e}")
+            return StateStore(":memory:")
 
     def _load_webhooks(self):
         try:
-            if os.path.exists(WEBHOOK_FILE) and os.path.getsize(WEBHOOK_FILE) > 0:
-                with open(WEBHOOK_FILE, "r", encoding="utf-8") as f:
-                    loaded = toml.load(f)
-                    self.logger.info(f"[TelePwn] Loaded webhooks: {loaded}")
-                    return loaded
-            self.logger.info("[TelePwn] Webhook file empty or missing, starting fresh")
-            return {}
+            loaded = self.store.webhooks()
+            self.logger.info(f"[TelePwn] Loaded webhooks: {loaded}")
+            return loaded
         except Exception as e:
             self.logger.error(f"[TelePwn] Failed to load webhooks: {e}")
             return {}
 
-    def _save_webhooks(self):
-        try:
-            with open(WEBHOOK_FILE, "w", encoding="utf-8") as f:
-                toml.dump(self.webhooks, f)
-            self.logger.info(f"[TelePwn] Webhooks saved to {WEBHOOK_FILE}: {self.webhooks}")
-        except Exception as e:
-            self.logger.error(f"[TelePwn] Failed to save webhooks: {e}")
-            raise
-
     def _load_schedules(self):
         try:
-            if os.path.exists(SCHEDULE_FILE) and os.path.getsize(SCHEDULE_FILE) > 0:
-                with open(SCHEDULE_FILE, "r", encoding="utf-8") as f:
-                    loaded = toml.load(f)
-                    self.logger.info(f"[TelePwn] Loaded schedules: {loaded}")
-                    return loaded
-            self.logger.info("[TelePwn] Schedule file empty or missing, starting fresh")
-            return {}
+            loaded = self.store.schedules()
+            self.logger.info(f"[TelePwn] Loaded schedules: {loaded}")
+            return loaded
         except Exception as e:
             self.logger.error(f"[TelePwn] Failed to load schedules: {e}")
             return {}
 
-    def _save_schedules(self):
-        try:
-            with open(SCHEDULE_FILE, "w", encoding="utf-8") as f:
-                toml.dump(self.schedules, f)
-            self.logger.info(f"[TelePwn] Schedules saved to {SCHEDULE_FILE}: {self.schedules}")
-        except Exception as e:
-            self.logger.error(f"[TelePwn] Failed to save schedules: {e}")
-            raise
-
     def on_loaded(self):
         self.logger.info("[TelePwn] Plugin loaded.")
         # Load options from config.toml
@@ -151,30 +1564,78 @@ class TelePwn(plugins.Plugin):
                 self.options["chat_id"] = plugins_config.get("chat_id", "")
                 self.options["send_message"] = plugins_config.get("send_message", True)
                 self.options["auto_start"] = plugins_config.get("auto_start", True)
+                self.options["profiling"] = plugins_config.get("profiling", False)
+                self.options["helper_socket"] = plugins_config.get("helper_socket", HELPER_SOCKET)
+                self.helper = HelperClient(self.options["helper_socket"])
+                self.options["inbox_poll"] = plugins_config.get("inbox_poll", True)
+                self.options["inbox_notify"] = plugins_config.get("inbox_notify", True)
+                self.options["dashboard"] = plugins_config.get("dashboard", False)
+                self.options["dashboard_interval"] = max(DASHBOARD_MIN_INTERVAL, int(plugins_config.get("dashboard_interval", 120)))
+                self.options["watchdog"] = plugins_config.get("watchdog", True)
+                self.options["watchdog_stall"] = max(WATCHDOG_INTERVAL * 2, int(plugins_config.get("watchdog_stall", WATCHDOG_STALL_SECONDS)))
+                fleet_config = plugins_config.get("fleet", {})
+                self.options["fleet_coordinator"] = fleet_config.get("coordinator", "")
+                self.options["fleet_unit"] = fleet_config.get("unit") or socket.gethostname()
+                self.options["fleet_token"] = fleet_config.get("token", "")
+                self.options["fleet_member"] = fleet_config.get("member", False)
+                self.options["rules_interval"] = max(RULE_MIN_SAMPLE_INTERVAL, int(plugins_config.get("rules_interval", RULE_SAMPLE_INTERVAL)))
+                self.rules = RulesEngine(plugins_config.get("rules", []))
+                self.throttle = ActionThrottle(self._throttle_limits(plugins_config.get("throttle", {})))
         except Exception as e:
             self.logger.error(f"[TelePwn] Failed to load config: {e}")
             return
 
-        if not self.options.get("bot_token") or not self.options.get("chat_id"):
+        # Fleet members answer through the coordinator and do not need a bot of their own
+        if not self.options.get("fleet_member") and (not self.options.get("bot_token") or not self.options.get("chat_id")):
             self.logger.error("[TelePwn] Missing bot_token or chat_id in config.toml.")
             return
 
         with TelePwn._lock:
-            if TelePwn._instance:
-                TelePwn._instance.stop_bot()
+            # A reload creates a new instance; the old one must not keep polling, sampling or scheduling
+            if TelePwn._instance and TelePwn._instance is not self:
+                TelePwn._instance.stop()
             TelePwn._instance = self
         self.load_config()
         self.start_scheduler()
+        self.report_restart()
+        if self.options.get("inbox_poll", True):
+            self.start_inbox_poller()
+        if self.options.get("fleet_coordinator"):
+            self.start_fleet()
+        self.start_rules()
+
+    def _throttle_limits(self, overrides):
+        limits = {}
+        for action_class, defaults in THROTTLE_DEFAULTS.items():
+            limit = dict(defaults)
+            custom = overrides.get(action_class, {})
+            if isinstance(custom, dict):
+                for key in ("per_minute", "burst"):
+                    if key in custom:
+                        limit[key] = float(custom[key]) if key == "per_minute" else int(custom[key])
+            limits[action_class] = limit
+        return limits
 
     def on_unload(self, ui=None):
         self.logger.info("[TelePwn] Plugin unloading...")
         with TelePwn._lock:
             if TelePwn._instance is self:
-                self.stop_bot()
-                self.stop_scheduler()
+                self.stop()
                 TelePwn._instance = None
         self.logger.info("[TelePwn] Plugin fully unloaded.")
 
+    def stop(self):
+        # Signal and join every background thread this instance started, then release the state store
+        self.stop_watchdog()
+        self.stop_fleet()
+        self.stop_rules()
+        self.stop_bot()
+        self.stop_scheduler()
+        self.stop_inbox_poller()
+        self.stop_dashboard()
+        self.display.cancel()
+        self.store.close()
+
     def load_config(self):
         try:
             with open(CONFIG_FILE, "r", encoding="utf-8") as f:
@@ -191,41 +1652,55 @@ class TelePwn(plugins.Plugin):
             self.on_internet_available(agent)
 
     def on_handshake(self, agent, filename, access_point, client_station):
-        display = agent.view()
+        event = {"essid": access_point.get("hostname") or "", "bssid": access_point.get("mac") or "",
+                 "station": client_station.get("mac") or "", "filename": filename}
+        self.emit_event("handshake", event)
+        self.emit_event("captures", event)
         try:
-            bot = telegram.Bot(self.options["bot_token"])
             message = f"\ud83e\udd1d New handshake: {access_point['hostname']} - {client_station['mac']}"
-            if self.options.get("send_message", False):
+            self.last_capture = (time(), access_point.get("hostname") or access_point.get("mac", "?"))
+            # Fleet members have no bot of their own; the owner's /handshakes covers them
+            if self.options.get("send_message", False) and self.options.get("bot_token"):
+                bot = telegram.Bot(self.options["bot_token"])
                 bot.send_message(
                     chat_id=int(self.options["chat_id"]),
                     text=message,
                     disable_web_page_preview=True,
                 )
                 self.logger.info(f"Sent handshake notification: {message}")
-            display.set("status", "Handshake sent to Telegram!")
-            display.update(force=True)
+                self.display.set(agent.view(), "status", "Handshake sent to Telegram!")
         except Exception as e:
             self.logger.error(f"Error sending handshake: {e}")
 
     def on_internet_available(self, agent):
-        if self.updater and self.updater.running:
-            self.logger.debug("[TelePwn] Already connected, skipping initialization.")
+        if self.options.get("fleet_member"):
+            self.agent = agent
             return
-        self.logger.info("[TelePwn] Starting Telegram bot...")
-        try:
-            self.start_bot(agent)
-        except Exception as e:
-            self.logger.error(f"[TelePwn] Error connecting to Telegram: {e}")
-            if self.updater:
-                self.updater.stop()
-                self.updater = None
-
-    def start_bot(self, agent):
-        self.updater = Updater(self.options["bot_token"], use_context=True)
+        with self.bot_lock:
+            if self.updater and self.updater.running:
+                self.logger.debug("[TelePwn] Already connected, skipping initialization.")
+                return
+            self.logger.info("[TelePwn] Starting Telegram bot...")
+            try:
+                self.start_bot(agent)
+            except Exception as e:
+                self.logger.error(f"[TelePwn] Error connecting to Telegram: {e}")
+                if self.updater:
+                    self.updater.stop()
+                    self.updater = None
+
+    def _start_polling(self, agent):
+        bot = MonitoredBot(self.options["bot_token"], self.monitor, request=Request(con_pool_size=UPDATER_WORKERS + 4))
+        self.updater = Updater(bot=bot, workers=UPDATER_WORKERS, use_context=True)
         self.register_handlers(agent, self.updater.dispatcher)
+        self.polling_started = time()
         self.updater.start_polling()
         self.logger.info("[TelePwn] Telegram polling started.")
 
+    def start_bot(self, agent):
+        self.agent = agent
+        self._start_polling(agent)
+
         bot = telegram.Bot(self.options["bot_token"])
         bot.set_my_commands(
             commands=[
@@ -233,14 +1708,16 @@ class TelePwn(plugins.Plugin):
                 BotCommand("reboot", "Reboot the device"),
                 BotCommand("shutdown", "Shutdown with clear"),
                 BotCommand("uptime", "Check uptime"),
-                BotCommand("handshakes", "Count captured handshakes"),
+                BotCommand("handshakes", "Count captured handshakes (summary)"),
                 BotCommand("screenshot", "Take a screenshot"),
                 BotCommand("backup", "Create and send a backup"),
                 BotCommand("restart_manual", "Restart daemon in manual mode"),
                 BotCommand("restart_auto", "Restart daemon in auto mode"),
+                BotCommand("restarts", "Show restart/reboot durations"),
                 BotCommand("kill", "Kill the daemon"),
                 BotCommand("clear", "Clear the screen"),
                 BotCommand("logs", "View recent logs"),
+                BotCommand("logsearch", "Search logs: <regex> [since] [until]"),
                 BotCommand("inbox", "Check Pwngrid inbox"),
                 BotCommand("plugins", "List plugins"),
                 BotCommand("toggle", "Toggle a plugin"),
@@ -248,10 +1725,16 @@ class TelePwn(plugins.Plugin):
                 BotCommand("webhook", "Trigger a custom webhook action"),
                 BotCommand("config", "Edit config.toml (view/set/list)"),
                 BotCommand("stats", "Show system stats"),
+                BotCommand("dashboard", "Pinned status dashboard (on/off)"),
                 BotCommand("pwngrid", "Pwngrid actions (send/clear)"),
-                BotCommand("files", "Manage files (list/download/upload)"),
+                BotCommand("files", "Manage files (list/download/upload/hashes)"),
                 BotCommand("schedule", "Manage scheduled tasks (add/remove/list)"),
                 BotCommand("shell", "Run shell commands (with confirmation)"),
+                BotCommand("perf", "Polling health, reconnects and API error rates"),
+                BotCommand("fleet", "Fleet units and fan-out (status @all)"),
+                BotCommand("rules", "Event rules and their fire counts"),
+                BotCommand("profile", "Profile CPU or memory (cpu/mem)"),
+                BotCommand("batch", "Run several commands at once, or save macros"),
             ],
             scope=telegram.BotCommandScopeAllPrivateChats(),
         )
@@ -262,6 +1745,11 @@ class TelePwn(plugins.Plugin):
             reply_markup=InlineKeyboardMarkup(INITIAL_MENU),
             parse_mode="HTML",
         )
+        self.report_restart(agent)
+        if self.options.get("dashboard", False):
+            self.start_dashboard(agent)
+        if self.options.get("watchdog", True):
+            self.start_watchdog()
 
     def stop_bot(self):
         if self.updater:
@@ -270,8 +1758,308 @@ class TelePwn(plugins.Plugin):
                 self.logger.info("[TelePwn] Telegram polling stopped.")
             self.updater = None
 
+    def start_watchdog(self):
+        if self.watchdog_thread and self.watchdog_thread.is_alive():
+            return
+        self.watchdog_stop.clear()
+        self.watchdog_thread = threading.Thread(target=self.run_watchdog, daemon=True)
+        self.watchdog_thread.start()
+        self.logger.info("[TelePwn] Polling watchdog started.")
+
+    def stop_watchdog(self):
+        self.watchdog_stop.set()
+        if self.watchdog_thread:
+            self.watchdog_thread.join(timeout=WATCHDOG_INTERVAL)
+            self.watchdog_thread = None
+
+    def run_watchdog(self):
+        # Restarts the updater when getUpdates stops succeeding, even if it still claims to be running
+        next_attempt = 0
+        while not self.watchdog_stop.wait(WATCHDOG_INTERVAL):
+            # A freshly started updater gets the full stall window before it is judged
+            idle = min(self.monitor.idle(), time() - self.polling_started)
+            if not self.updater or idle < self.options["watchdog_stall"] or time() < next_attempt:
+                continue
+            attempt = self.monitor.stall()
+            self.logger.warning(f"[TelePwn] No successful getUpdates for {int(self.monitor.idle())}s, restarting polling (attempt {attempt})")
+            try:
+                self.restart_polling()
+            except Exception as e:
+                self.logger.error(f"[TelePwn] Polling restart failed: {e}")
+            # Exponential backoff with jitter so a flapping link is not hammered
+            delay = min(WATCHDOG_MAX_BACKOFF, WATCHDOG_BASE_BACKOFF * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            next_attempt = time() + delay
+
+    def restart_polling(self):
+        with self.bot_lock:
+            old, self.updater = self.updater, None
+            if old:
+                # A wedged poll can block stop() forever; give it a bounded chance and move on
+                stopper = threading.Thread(target=old.stop, daemon=True)
+                stopper.start()
+                stopper.join(WATCHDOG_STOP_TIMEOUT)
+                if stopper.is_alive():
+                    self.logger.warning("[TelePwn] Old updater did not stop in time, abandoning it")
+            self._start_polling(self.agent)
+
+    def start_fleet(self):
+        if not self.options.get("fleet_token"):
+            self.logger.error("[TelePwn] Fleet mode needs main.plugins.telepwn.fleet.token")
+            return
+        self.fleet = FleetClient(self.options["fleet_coordinator"], self.options["fleet_unit"], self.options["fleet_token"], self.fleet_reading)
+        self.fleet.start()
+
+    def stop_fleet(self):
+        if self.fleet:
+            self.fleet.stop()
+            self.fleet = None
+
+    def fleet_reading(self, command):
+        reading = {}
+        if command in ("status", "uptime"):
+            seconds = self._read_uptime()
+            reading["uptime"] = f"{int(seconds // 3600)}h {int(seconds % 3600 // 60)}m"
+        if command in ("status", "handshakes"):
+            reading["handshakes"] = self._count_handshakes()
+        if command == "handshakes":
+            reading["crackable"] = sum(1 for row in self.captures.refresh().values() if row["status"] == "crackable")
+        if command in ("status", "stats"):
+            reading["cpu"] = f"{psutil.cpu_percent(interval=1)}%"
+            reading["mem"] = f"{psutil.virtual_memory().percent}%"
+            reading["temp"] = self._read_temperature()
+        if command in ("status", "mode"):
+            reading["mode"] = self._current_mode(self.agent)
+        return reading
+
+    def start_rules(self):
+        for error in self.rules.errors:
+            self.logger.error(f"[TelePwn] Ignoring {error}")
+        if not self.rules.rules:
+            return
+        self.rules_pool = ThreadPoolExecutor(max_workers=RULE_WORKERS, thread_name_prefix="telepwn-rules")
+        self.logger.info(f"[TelePwn] Loaded {len(self.rules.rules)} rule(s) for {', '.join(sorted(self.rules.by_event))}")
+        if self.rules.sampled():
+            self.rules_stop.clear()
+            self.rules_thread = threading.Thread(target=self.run_rule_sampler, daemon=True)
+            self.rules_thread.start()
+
+    def stop_rules(self):
+        self.rules_stop.set()
+        if self.rules_thread and self.rules_thread is not threading.current_thread():
+            self.rules_thread.join(timeout=5)
+        self.rules_thread = None
+        if self.rules_pool:
+            self.rules_pool.shutdown(wait=False)
+            self.rules_pool = None
+
+    def run_rule_sampler(self):
+        # Only the readings some rule asks for are taken
+        events = self.rules.sampled()
+        interval = self.options.get("rules_interval", RULE_SAMPLE_INTERVAL)
+        while not self.rules_stop.wait(interval):
+            readings = {}
+            try:
+                if "temperature" in events:
+                    temp = self._read_temperature()
+                    if isinstance(temp, (int, float)):
+                        readings["temperature"] = temp
+                if "memory" in events:
+                    readings["memory"] = psutil.virtual_memory().percent
+                if "disk_free" in events:
+                    readings["disk_free"] = shutil.disk_usage(HANDSHAKE_DIR).free // (1024 * 1024)
+            except Exception as e:
+                self.logger.warning(f"[TelePwn] Rule sampling failed: {e}")
+            self.rules_sample = dict(readings, at=time())
+            for event, value in readings.items():
+                self.emit_event(event, {"value": value})
+
+    def emit_event(self, event, data):
+        if event not in self.rules.by_event:
+            return
+        data = dict(data, event=event, at=time())
+        for rule in self.rules.emit(event, data):
+            self.logger.info(f"[TelePwn] Rule {rule['name']} fired on {event}")
+            try:
+                future = self.rules_pool.submit(self.fire_rule, rule, data)
+            except (AttributeError, RuntimeError):
+                # Unloading; the pool is already gone
+                return
+            future.add_done_callback(lambda future, name=rule["name"]: self._rule_done(name, future))
+
+    def _rule_done(self, name, future):
+        error = future.exception()
+        if error:
+            self.logger.error(f"[TelePwn] Rule {name} failed: {error!r}")
+
+    def fire_rule(self, rule, data):
+        chat_id = int(self.options["chat_id"]) if self.options.get("chat_id") else None
+        bot = self.updater.bot if self.updater else (telegram.Bot(self.options["bot_token"]) if self.options.get("bot_token") else None)
+        # Handlers reply through send_message, which collects into the capture buffer as in /batch
+        update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), callback_query=None, effective_message=None)
+        context = SimpleNamespace(bot=bot, args=[])
+        output = ""
+        if rule["kind"] == "command":
+            # _batch_run skips the interactive throttle, so rules and chat users never starve each other,
+            # but a backup or kill that is already running (from chat or another rule) is not started twice
+            output = self._batch_run(BATCH_COMMANDS[rule["target"]], self._dispatch_table(), self.agent, update, context)
+        elif rule["kind"] == "webhook":
+            # Event fields are not passed to the webhook's command line: ESSIDs are attacker-chosen
+            output = self._captured(f"Rule {rule['name']}", self._run_webhook, self.agent, update, context, rule["target"], rule["extra"], data)
+        fields = {key: value for key, value in data.items() if key not in ("at", "event")}
+        header = f"\u26a1 Rule {rule['name']}: {rule['summary']}"
+        if "value" in data:
+            header += f" (now {data['value']:g})"
+        elif data.get("essid") or data.get("bssid"):
+            header += f" ({data.get('essid') or '?'} {data.get('bssid', '')})".rstrip()
+        if rule["message"]:
+            try:
+                header = rule["message"].format(rule=rule["name"], **fields)
+            except (KeyError, IndexError, ValueError, AttributeError, TypeError) as e:
+                self.logger.warning(f"[TelePwn] Rule {rule['name']} message has a bad placeholder: {e!r}")
+        text = html.escape(header)
+        if output:
+            text += "\n" + html.escape(output[:MAX_MESSAGE_LENGTH])
+        if bot is None or chat_id is None:
+            self.logger.info(f"[TelePwn] {header} {output}".rstrip())
+            return
+        try:
+            bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", disable_web_page_preview=True)
+        except Exception as e:
+            self.logger.error(f"[TelePwn] Rule {rule['name']} could not notify: {e}")
+
+    def rules_command(self, agent, update, context):
+        if update.effective_chat.id != int(self.options.get("chat_id")):
+            return
+        args = context.args or []
+        if len(args) == 2 and args[0].lower() == "test":
+            rule = self.rules.find(args[1])
+            if rule is None:
+                self.send_message(update, context, f"\u26d4 No rule named {html.escape(args[1])}")
+                return
+            # Runs the action as if the rule had matched, without touching its cooldown
+            self.send_message(update, context, f"\ud83d\udd27 Testing rule {html.escape(rule['name'])}...")
+            try:
+                self.fire_rule(rule, {"event": rule["event"], "at": time(), "essid": "test", "bssid": "", "station": "", "filename": ""})
+            except Exception as e:
+                self.logger.error(f"[TelePwn] Rule {rule['name']} failed: {e!r}")
+                self.send_message(update, context, f"\u26d4 Rule {html.escape(rule['name'])} failed: {html.escape(str(e))}")
+            return
+        if not self.rules.rules and not self.rules.errors:
+            self.send_message(update, context, "\u26a0 No rules configured. Add [[main.plugins.telepwn.rules]] tables to config.toml.")
+            return
+        now = time()
+        lines = [f"\u26a1 Rules ({len(self.rules.rules)}):"]
+        for rule in self.rules.rules:
+            last = f", last {int(now - rule['last'])}s ago" if rule["last"] is not None else ""
+            lines.append(f"{html.escape(rule['name'])}: {html.escape(rule['summary'])} → {html.escape(rule['action'])}"
+                         f" (cooldown {int(rule['cooldown'])}s, fired {rule['fired']}, suppressed {rule['suppressed']}{last})")
+        sample = self.rules_sample
+        if sample:
+            readings = []
+            if "temperature" in sample:
+                readings.append(f"temp {sample['temperature']}°C")
+            if "memory" in sample:
+                readings.append(f"mem {sample['memory']}%")
+            if "disk_free" in sample:
+                readings.append(f"disk {sample['disk_free']} MB free")
+            lines.append(f"Last sample {int(now - sample['at'])}s ago: {', '.join(readings) or 'n/a'}")
+        lines.extend(f"\u26d4 {html.escape(error)}" for error in self.rules.errors)
+        lines.append(html.escape("Usage: /rules [test <name>]"))
+        self.send_message(update, context, "\n".join(lines))
+
+    def _fleet_aware(self, command, handler, agent, update, context):
+        # "/stats @all" or "/stats @pwn2 @pwn3" fans out; plain "/stats" stays local
+        targets = [arg[1:] for arg in context.args or [] if arg.startswith("@") and len(arg) > 1]
+        if not targets:
+            handler(agent, update, context)
+            return
+        context.args = [arg for arg in context.args if not arg.startswith("@")]
+        self.fleet_dispatch(update, context, command, targets)
+
+    def fleet_command(self, agent, update, context):
+        if update.effective_chat.id != int(self.options.get("chat_id")):
+            return
+        args = context.args or []
+        if not self.fleet:
+            self.send_message(update, context, "\u26a0 Fleet mode is not configured. Set main.plugins.telepwn.fleet.coordinator and token.")
+            return
+        if not args or args[0].lower() == "units":
+            try:
+                units = self.fleet.units()
+            except (requests.RequestException, ValueError, KeyError) as e:
+                self.send_message(update, context, f"\u26d4 Fleet coordinator unreachable: {e}")
+                return
+            if not units:
+                self.send_message(update, context, "\u26a0 No units have registered yet.")
+                return
+            lines = [("\u2705" if age < 60 else "\u26a0") + f" {html.escape(name)} (seen {age:.0f}s ago)" for name, age in sorted(units.items())]
+            self.send_message(update, context, f"\ud83d\udef0 Fleet ({len(units)} units):\n" + "\n".join(lines) + f"\nUsage: /fleet <{'|'.join(FLEET_COMMANDS)}> [@all|@unit ...]")
+            return
+        command = args[0].lower()
+        if command not in FLEET_COMMANDS:
+            self.send_message(update, context, f"\u26d4 Unknown fleet command. Use one of: {', '.join(FLEET_COMMANDS)}")
+            return
+        targets = [arg[1:] for arg in args[1:] if arg.startswith("@") and len(arg) > 1] or ["all"]
+        self.fleet_dispatch(update, context, command, targets)
+
+    def fleet_dispatch(self, update, context, command, targets):
+        if not self.fleet:
+            self.send_message(update, context, "\u26a0 Fleet mode is not configured. Set main.plugins.telepwn.fleet.coordinator and token.")
+            return
+        context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        started = time()
+        try:
+            results = self.fleet.dispatch(command, targets)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            self.send_message(update, context, f"\u26d4 Fleet coordinator unreachable: {e}")
+            return
+        if not results:
+            self.send_message(update, context, "\u26a0 No units are online.")
+            return
+        rows = []
+        for unit, outcome in sorted(results.items()):
+            if outcome.get("ok"):
+                rows.append((unit, outcome.get("result") or {}))
+            else:
+                rows.append((unit, {"error": outcome.get("error", "failed")}))
+        columns = [column for column in FLEET_COLUMNS if any(column in reading for _, reading in rows)]
+        if any("error" in reading for _, reading in rows):
+            columns.append("error")
+        table = [["unit"] + columns] + [[unit] + [str(reading.get(column, "")) for column in columns] for unit, reading in rows]
+        widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+        text = "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in table)
+        ok = sum(1 for _, reading in rows if "error" not in reading)
+        self.send_message(update, context, f"\ud83d\udef0 /{command} on {ok}/{len(rows)} units ({time() - started:.1f}s):\n<pre>{html.escape(text)}</pre>")
+
+    def perf_command(self, agent, update, context):
+        stats = self.monitor.stats()
+        errors = sum(stats["errors"].values())
+        rate = f"{errors * 100 / stats['calls']:.1f}%" if stats["calls"] else "n/a"
+        lines = [
+            "\ud83d\udcc8 Performance",
+            f"Polling: last getUpdates OK {int(self.monitor.idle())}s ago, {stats['polls']} polls in {API_STATS_WINDOW // 60} min",
+        ]
+        if stats["stalled_for"] is not None:
+            lines.append(f"\u26a0 Stalled for {int(stats['stalled_for'])}s, reconnecting with backoff")
+        recoveries = stats["recoveries"]
+        if recoveries:
+            lines.append(f"Reconnects: {stats['reconnects']} (recovered {len(recoveries)}x, last {recoveries[-1]:.0f}s, avg {sum(recoveries) / len(recoveries):.0f}s, max {max(recoveries):.0f}s)")
+        else:
+            lines.append(f"Reconnects: {stats['reconnects']}")
+        lines.append(f"Bot API ({API_STATS_WINDOW // 60} min): {stats['calls']} calls, {errors} errors ({rate})")
+        if stats["latency_p50"] is not None:
+            lines.append(f"Latency (excluding long-polls): p50 {stats['latency_p50'] * 1000:.0f}ms, max {stats['latency_max'] * 1000:.0f}ms")
+        if stats["errors"]:
+            lines.append("Errors: " + ", ".join(f"{name} {count}" for name, count in sorted(stats["errors"].items(), key=lambda item: -item[1])))
+        pending = self.pending.stats()
+        lines.append(f"Buttons: {pending['live']} live, {pending['used']} used, {pending['expired']} expired")
+        if self.throttle.hits:
+            lines.append("Throttled: " + ", ".join(f"{name} {count}" for name, count in sorted(self.throttle.hits.items())))
+        self.send_message(update, context, "\n".join(lines))
+
     def start_scheduler(self):
         self.running = True
+        self.schedule_wake.clear()
         self.schedule_thread = threading.Thread(target=self.run_scheduler)
         self.schedule_thread.daemon = True
         self.schedule_thread.start()
@@ -279,10 +2067,15 @@ class TelePwn(plugins.Plugin):
 
     def stop_scheduler(self):
         self.running = False
+        self.schedule_wake.set()
         if self.schedule_thread:
             self.schedule_thread.join()
+            self.schedule_thread = None
         schedule.clear()
         self.logger.info("[TelePwn] Scheduler stopped.")
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self.mem_snapshot = None
 
     def run_scheduler(self):
         for task_id, task in self.schedules.items():
@@ -294,17 +2087,18 @@ class TelePwn(plugins.Plugin):
                 schedule.every(interval).hours.do(lambda: self._scheduled_backup())
         while self.running:
             schedule.run_pending()
-            sleep(60)
+            # Waking early lets stop() join this thread without sitting out the minute
+            self.schedule_wake.wait(60)
 
     def _scheduled_reboot(self):
         try:
             bot = telegram.Bot(self.options["bot_token"])
-            bot.send_message(
+            message = bot.send_message(
                 chat_id=int(self.options["chat_id"]),
                 text="\ud83d\udd04 Scheduled reboot triggered...",
                 parse_mode="HTML",
             )
-            subprocess.run(["sudo", "reboot"], check=True)
+            self._tracked_restart("scheduled reboot", None, message, lambda: self._service("reboot"))
         except Exception as e:
             self.logger.error(f"[TelePwn] Scheduled reboot failed: {e}")
 
@@ -313,24 +2107,7 @@ class TelePwn(plugins.Plugin):
             bot = telegram.Bot(self.options["bot_token"])
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_path = f"/home/pi/telepwn_scheduled_backup_{timestamp}.tar.gz"
-            backup_files = [
-                "/root/settings.yaml",
-                "/root/client_secrets.json",
-                "/home/pi/handshakes/",
-                "/root/.api-report.json",
-                "/root/.ssh",
-                "/root/.bashrc",
-                "/root/.profile",
-                "/root/peers",
-                "/etc/pwnagotchi/",
-                "/usr/local/share/pwnagotchi/custom-plugins",
-                "/etc/ssh/",
-                "/home/pi/.bashrc",
-                "/home/pi/.profile",
-                "/root/.auto-update",
-                "/home/pi/.wpa_sec_Uploads",
-            ]
-            existing_files = [f for f in backup_files if os.path.exists(f)]
+            existing_files = [f for f in BACKUP_FILES if os.path.exists(f)]
             if not existing_files:
                 bot.send_message(
                     chat_id=int(self.options["chat_id"]),
@@ -338,7 +2115,7 @@ class TelePwn(plugins.Plugin):
                     parse_mode="HTML",
                 )
                 return
-            subprocess.run(["sudo", "tar", "czf", backup_path] + existing_files, check=True)
+            self._archive(backup_path, existing_files)
             size_mb = round(os.path.getsize(backup_path) / (1024 * 1024), 2)
             with open(backup_path, "rb") as backup:
                 bot.send_document(chat_id=int(self.options["chat_id"]), document=backup)
@@ -356,33 +2133,166 @@ class TelePwn(plugins.Plugin):
                 parse_mode="HTML",
             )
 
+    def _load_inbox_seen(self):
+        return self.store.get("inbox.seen")
+
+    def _save_inbox_seen(self):
+        try:
+            self.store.set("inbox.seen", self.inbox_seen[-INBOX_SEEN_LIMIT:])
+        except Exception as e:
+            self.logger.error(f"[TelePwn] Failed to save inbox state: {e}")
+
+    def start_inbox_poller(self):
+        self.inbox_running = True
+        self.inbox_wake.clear()
+        self.inbox_thread = threading.Thread(target=self.run_inbox_poller, daemon=True)
+        self.inbox_thread.start()
+        self.logger.info("[TelePwn] Inbox poller started.")
+
+    def stop_inbox_poller(self):
+        self.inbox_running = False
+        self.inbox_wake.set()
+        if self.inbox_thread:
+            self.inbox_thread.join()
+            self.inbox_thread = None
+        self.logger.info("[TelePwn] Inbox poller stopped.")
+
+    def run_inbox_poller(self):
+        interval = INBOX_POLL_MIN
+        while self.inbox_running:
+            try:
+                new_messages = self.refresh_inbox()
+                if new_messages:
+                    interval = INBOX_POLL_MIN
+                    self._push_inbox(new_messages)
+                else:
+                    interval = min(interval * 2, INBOX_POLL_MAX)
+            except Exception as e:
+                self.logger.warning(f"[TelePwn] Inbox poll failed: {e}")
+                interval = min(interval * 2, INBOX_POLL_MAX)
+            self.inbox_wake.wait(interval)
+            self.inbox_wake.clear()
+
+    def refresh_inbox(self):
+        # Returns messages not seen before; the very first poll only records a baseline
+        output = subprocess.check_output(["pwngrid", "--inbox"], text=True, timeout=60)
+        messages = parse_pwngrid_inbox(output)
+        with self.inbox_lock:
+            if self.inbox_seen is None:
+                self.inbox_seen = self._load_inbox_seen()
+            baseline = self.inbox_seen is None
+            seen = set(self.inbox_seen or [])
+            new_messages = [m for m in messages if m["id"] not in seen]
+            self.inbox_messages = messages
+            self.inbox_fetched_at = time()
+            if new_messages or baseline:
+                self.inbox_seen = (self.inbox_seen or []) + [m["id"] for m in new_messages]
+                self._save_inbox_seen()
+        return [] if baseline else new_messages
+
+    def invalidate_inbox(self, cleared=False):
+        with self.inbox_lock:
+            if cleared:
+                # Cleared messages stay in the seen list so they are never pushed again
+                self.inbox_messages = []
+                self.inbox_fetched_at = time()
+            else:
+                self.inbox_fetched_at = None
+        self.inbox_wake.set()
+
+    def _push_inbox(self, messages):
+        if not self.options.get("inbox_notify", True) or not self.options.get("bot_token"):
+            return
+        try:
+            bot = telegram.Bot(self.options["bot_token"])
+            lines = [self._format_inbox_message(m) for m in messages]
+            bot.send_message(
+                chat_id=int(self.options["chat_id"]),
+                text="\ud83d\udce8 New Pwngrid message(s):\n" + "\n".join(lines),
+                disable_web_page_preview=True,
+            )
+        except Exception as e:
+            self.logger.error(f"[TelePwn] Failed to push inbox messages: {e}")
+
+    def _format_inbox_message(self, message):
+        extra = " ".join(v for k, v in message.items() if k != "id" and v)
+        return f"#{message['id']} {extra}".strip()
+
+    def _privileged(self, op, fallback, **args):
+        # Prefer the long-lived helper; fall back to sudo when it isn't installed
+        if self.helper.available():
+            try:
+                return self.helper.call(op, **args)
+            except HelperUnavailable as e:
+                self.logger.warning(f"[TelePwn] Helper unreachable for {op}, falling back to sudo: {e}")
+            except (OSError, ValueError) as e:
+                # The helper took the request (timeout, garbled reply); running it again via sudo could
+                # restart or signal twice, so report it instead
+                self.logger.error(f"[TelePwn] Helper {op} did not answer cleanly: {e}")
+                raise HelperError(1, op, output=f"no clean reply from helper ({str(e) or type(e).__name__})") from e
+        for command in fallback:
+            subprocess.run(command, check=True)
+        return {}
+
+    def _set_mode(self, mode):
+        other = "auto" if mode == "manual" else "manual"
+        self._privileged("flag", [
+            ["sudo", "touch", f"/root/.pwnagotchi-{mode}"],
+            ["sudo", "rm", "-f", f"/root/.pwnagotchi-{other}"],
+        ], mode=mode)
+
+    def _sync(self):
+        self._privileged("sync", [["sudo", "sync"]])
+
+    def _service(self, action, name="pwnagotchi"):
+        if action == "reboot":
+            self._privileged("service", [["sudo", "reboot"]], action=action)
+        elif action == "poweroff":
+            self._privileged("service", [["sudo", "shutdown", "-h", "now"]], action=action)
+        else:
+            self._privileged("service", [["sudo", "systemctl", action, name]], action=action, name=name)
+
+    def _reload_plugins(self):
+        self._privileged("signal", [["sudo", "killall", "-USR1", "pwnagotchi"]], signal_name="USR1")
+
+    def _archive(self, output, paths):
+        self._privileged("archive", [["sudo", "tar", "czf", output] + paths], output=output, paths=paths)
+
     def register_handlers(self, agent, dispatcher):
         dispatcher.add_handler(CommandHandler("start", lambda update, context: self.start(agent, update, context)))
         dispatcher.add_handler(CommandHandler("reboot", lambda update, context: self.reboot(agent, update, context)))
         dispatcher.add_handler(CommandHandler("shutdown", lambda update, context: self.shutdown(agent, update, context)))
-        dispatcher.add_handler(CommandHandler("uptime", lambda update, context: self.uptime(agent, update, context)))
-        dispatcher.add_handler(CommandHandler("handshakes", lambda update, context: self.handshake_count(agent, update, context)))
+        dispatcher.add_handler(CommandHandler("uptime", lambda update, context: self._fleet_aware("uptime", self.uptime, agent, update, context), run_async=True))
+        dispatcher.add_handler(CommandHandler("handshakes", lambda update, context: self._fleet_aware("handshakes", self.handshake_count, agent, update, context), run_async=True))
         dispatcher.add_handler(CommandHandler("screenshot", lambda update, context: self.take_screenshot(agent, update, context)))
-        dispatcher.add_handler(CommandHandler("backup", lambda update, context: self.create_backup(agent, update, context)))
+        dispatcher.add_handler(CommandHandler("backup", lambda update, context: self._run_action("create_backup", self.create_backup, agent, update, context), run_async=True))
         dispatcher.add_handler(CommandHandler("restart_manual", lambda update, context: self.restart_manual(agent, update, context)))
         dispatcher.add_handler(CommandHandler("restart_auto", lambda update, context: self.restart_auto(agent, update, context)))
+        dispatcher.add_handler(CommandHandler("restarts", lambda update, context: self.restart_history(agent, update, context)))
         dispatcher.add_handler(CommandHandler("kill", lambda update, context: self.pwnkill(agent, update, context)))
         dispatcher.add_handler(CommandHandler("clear", lambda update, context: self.clear(agent, update, context)))
         dispatcher.add_handler(CommandHandler("logs", lambda update, context: self.logs(agent, update, context)))
+        dispatcher.add_handler(CommandHandler("logsearch", lambda update, context: self.log_search(agent, update, context), run_async=True))
         dispatcher.add_handler(CommandHandler("inbox", lambda update, context: self.inbox(agent, update, context)))
         dispatcher.add_handler(CommandHandler("plugins", lambda update, context: self.plugins_menu(agent, update, context)))
-        dispatcher.add_handler(CommandHandler("toggle", lambda update, context: self.toggle_plugin_command(agent, update, context)))
+        dispatcher.add_handler(CommandHandler("toggle", lambda update, context: self.toggle_plugin_command(agent, update, context), run_async=True))
         dispatcher.add_handler(CommandHandler("setwebhook", lambda update, context: self.set_webhook(agent, update, context)))
         dispatcher.add_handler(CommandHandler("webhook", lambda update, context: self.webhook(agent, update, context)))
         dispatcher.add_handler(CommandHandler("config", lambda update, context: self.config_editor(agent, update, context)))
-        dispatcher.add_handler(CommandHandler("stats", lambda update, context: self.system_stats(agent, update, context)))
+        dispatcher.add_handler(CommandHandler("stats", lambda update, context: self._fleet_aware("stats", self.system_stats, agent, update, context), run_async=True))
+        dispatcher.add_handler(CommandHandler("dashboard", lambda update, context: self.dashboard_command(agent, update, context)))
         dispatcher.add_handler(CommandHandler("pwngrid", lambda update, context: self.pwngrid_actions(agent, update, context)))
-        dispatcher.add_handler(CommandHandler("files", lambda update, context: self.file_manager(agent, update, context)))
+        dispatcher.add_handler(CommandHandler("files", lambda update, context: self.file_manager(agent, update, context), run_async=True))
         dispatcher.add_handler(CommandHandler("schedule", lambda update, context: self.schedule_manager(agent, update, context)))
         dispatcher.add_handler(CommandHandler("shell", lambda update, context: self.shell_command(agent, update, context)))
-        dispatcher.add_handler(CallbackQueryHandler(lambda update, context: self.button_handler(agent, update, context)))
+        dispatcher.add_handler(CommandHandler("batch", lambda update, context: self.batch_command(agent, update, context), run_async=True))
+        dispatcher.add_handler(CommandHandler("fleet", lambda update, context: self.fleet_command(agent, update, context), run_async=True))
+        dispatcher.add_handler(CommandHandler("rules", lambda update, context: self.rules_command(agent, update, context), run_async=True))
+        dispatcher.add_handler(CommandHandler("perf", lambda update, context: self.perf_command(agent, update, context)))
+        dispatcher.add_handler(CommandHandler("profile", lambda update, context: self.profile_command(agent, update, context)))
+        dispatcher.add_handler(CallbackQueryHandler(lambda update, context: self.button_handler(agent, update, context), run_async=True))
         # Add handler for document uploads
-        dispatcher.add_handler(MessageHandler(Filters.document, lambda update, context: self.handle_document_upload(agent, update, context)))
+        dispatcher.add_handler(MessageHandler(Filters.document, lambda update, context: self.handle_document_upload(agent, update, context), run_async=True))
 
     def start(self, agent, update, context):
         if update.callback_query and update.callback_query.data == "cancel":
@@ -393,16 +2303,39 @@ class TelePwn(plugins.Plugin):
         if update.effective_chat.id != int(self.options.get("chat_id")):
             return
         query = update.callback_query
-        query.answer()
 
-        current_time = time()
-        last_action = context.user_data.get("last_action", 0)
-        if current_time - last_action < COOLDOWN_SECONDS:
-            self.send_message(update, context, "\u26a0 Slow down! Wait a moment.")
-            return
-        context.user_data["last_action"] = current_time
+        actions = self._dispatch_table()
+
+        token_actions = {
+            "toggle_plugin": lambda a, u, c, p: self.toggle_plugin(a, u, c, p),
+            "plugins_page": lambda a, u, c, p: self.plugins_menu(a, u, c, page=p),
+            "inbox_page": lambda a, u, c, p: self.inbox(a, u, c, page=p),
+            "inbox_refresh": lambda a, u, c, p: self.inbox(a, u, c, refresh=True),
+            "logsearch_page": lambda a, u, c, p: self.log_search_page(u, c, *p),
+            "confirm_shell": lambda a, u, c, p: self.execute_shell_command(a, u, c, p),
+            "dedupe_apply": lambda a, u, c, p: self.dedupe_apply(u, c, p),
+            "upload_done": lambda a, u, c, p: self.finish_upload(u, c),
+            "config_browse": lambda a, u, c, p: self.config_browse(u, c, *p),
+            "config_complete": lambda a, u, c, p: self.config_complete(u, c, p),
+            "config_view": lambda a, u, c, p: self.config_view(u, c, p),
+            "config_apply": lambda a, u, c, p: self.config_apply(u, c),
+            "config_discard": lambda a, u, c, p: self.config_discard(u, c),
+        }
+
+        if query.data.startswith("t:"):
+            token = query.data[2:]
+            kind = self.pending.peek(update.effective_chat.id, token)
+            if kind not in token_actions:
+                self._answer(update, context, "\u26a0 This button has expired. Please run the command again.")
+                return
+            self._run_action(kind, lambda a, u, c: self._run_token(token_actions[kind], token, a, u, c), agent, update, context)
+        elif query.data in actions:
+            self._run_action(query.data, actions[query.data], agent, update, context)
+        else:
+            query.answer()
 
-        actions = {
+    def _dispatch_table(self):
+        return {
             "reboot": self.reboot,
             "reboot_manual": lambda a, u, c: self.reboot_mode("manual", u, c),
             "reboot_auto": lambda a, u, c: self.reboot_mode("auto", u, c),
@@ -417,6 +2350,8 @@ class TelePwn(plugins.Plugin):
             "pwnkill": self.pwnkill,
             "clear": self.clear,
             "logs": self.logs,
+            "system_stats": self.system_stats,
+            "restart_history": self.restart_history,
             "inbox": self.inbox,
             "plugins": self.plugins_menu,
             "cancel": self.start,
@@ -424,31 +2359,66 @@ class TelePwn(plugins.Plugin):
             "back_to_initial": lambda a, u, c: self.send_message(u, c, "\ud83d\udd90 TelePwn 2025 Edition", INITIAL_MENU),
         }
 
-        if query.data.startswith("toggle_plugin_"):
-            plugin_name = query.data[len("toggle_plugin_"):]
-            self.toggle_plugin(agent, update, context, plugin_name)
-        elif query.data.startswith("confirm_shell_"):
-            command = query.data[len("confirm_shell_"):]
-            self.execute_shell_command(agent, update, context, command)
-        elif query.data in actions:
-            actions[query.data](agent, update, context)
+    def _run_token(self, handler, token, agent, update, context):
+        pending = self.pending.take(update.effective_chat.id, token)
+        if pending is None:
+            self.send_message(update, context, "\u26a0 This button has expired. Please run the command again.")
+            return
+        handler(agent, update, context, pending[1])
+
+    def _run_action(self, action, handler, agent, update, context, *args):
+        # Throttle per action class; a duplicate of a running job is attached to it instead. The bot only
+        # serves the owner's chat, so the running job's reply already reaches whoever pressed twice.
+        action_class = ACTION_CLASSES.get(action, "read")
+        key = (action,) + args
+        if update.callback_query and update.callback_query.data.startswith("t:"):
+            key += (self.pending.payload_key(update.effective_chat.id, update.callback_query.data[2:]),)
+        if not self.throttle.begin(key):
+            self.logger.info(f"[TelePwn] Duplicate {action} attached to the running job")
+            self._answer(update, context, f"\u23f3 {action} is already running; its result will be posted here.")
+            return
+        try:
+            if not self.throttle.allow(action_class):
+                self.logger.info(f"[TelePwn] Throttled {action} (class {action_class})")
+                self._answer(update, context, "\u26a0 Slow down! Wait a moment.")
+                return
+            if update.callback_query:
+                update.callback_query.answer()
+            handler(agent, update, context, *args)
+        finally:
+            merged = self.throttle.end(key)
+            if merged:
+                self.logger.info(f"[TelePwn] {action} finished; merged {merged} duplicate request(s)")
+
+    def _answer(self, update, context, text):
+        # Button presses get a toast so the menu message stays intact
+        if update.callback_query:
+            update.callback_query.answer(text=text)
+        else:
+            self.send_message(update, context, text)
 
     def send_message(self, update, context, text, keyboard=None):
+        # Inside a /batch job, replies are collected for one combined message
+        buffer = getattr(self.capture, "buffer", None)
+        if buffer is not None:
+            buffer.append(text)
+            return None
         if update.effective_chat.id != int(self.options.get("chat_id")):
             return
         try:
             if len(text) > MAX_MESSAGE_LENGTH:
                 for chunk in [text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(text), MAX_MESSAGE_LENGTH)]:
-                    context.bot.send_message(chat_id=update.effective_chat.id, text=chunk, parse_mode="HTML")
+                    message = context.bot.send_message(chat_id=update.effective_chat.id, text=chunk, parse_mode="HTML")
+                return message
             else:
                 if update.callback_query:
-                    update.callback_query.edit_message_text(
+                    return update.callback_query.edit_message_text(
                         text=text,
                         reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None,
                         parse_mode="HTML",
                     )
                 else:
-                    update.effective_message.reply_text(
+                    return update.effective_message.reply_text(
                         text=text,
                         reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None,
                         parse_mode="HTML",
@@ -457,6 +2427,112 @@ class TelePwn(plugins.Plugin):
             self.logger.error(f"Error sending message: {e}")
             context.bot.send_message(chat_id=update.effective_chat.id, text=str(e))
 
+    def _load_restart_state(self):
+        return {"pending": self.store.get("restart.pending"), "history": self.store.get("restart.history", [])}
+
+    def _save_restart_state(self, state):
+        try:
+            with self.store.transaction():
+                if state.get("pending"):
+                    self.store.set("restart.pending", state["pending"])
+                else:
+                    self.store.delete("restart.pending")
+                self.store.set("restart.history", state.get("history", []))
+        except Exception as e:
+            self.logger.error(f"[TelePwn] Failed to save restart state: {e}")
+
+    def _boot_id(self):
+        try:
+            with open(BOOT_ID_FILE, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    def _tracked_restart(self, action, update, message, restart, mode=None):
+        # Persist who asked and when, so the next start can report how long it took
+        with self.restart_lock:
+            state = self._load_restart_state()
+            pending = {"action": action, "requested_at": time(), "boot_id": self._boot_id()}
+            if mode:
+                # on_loaded runs before the agent's view exists, so remember the mode we asked for
+                pending["mode"] = mode
+            chat_id = update.effective_chat.id if update else int(self.options["chat_id"])
+            pending["chat_id"] = chat_id
+            message_id = getattr(message, "message_id", None)
+            if message_id:
+                pending["message_id"] = message_id
+            state["pending"] = pending
+            self._save_restart_state(state)
+        try:
+            restart()
+        except Exception:
+            with self.restart_lock:
+                state = self._load_restart_state()
+                state.pop("pending", None)
+                self._save_restart_state(state)
+            raise
+
+    def _current_mode(self, agent=None):
+        try:
+            display = agent.view() if agent else view.ROOT
+            if display:
+                return display.get("mode") or "unknown"
+        except Exception:
+            pass
+        return "unknown"
+
+    def report_restart(self, agent=None):
+        with self.restart_lock:
+            state = self._load_restart_state()
+            pending = state.get("pending")
+            if not pending or not self.options.get("bot_token"):
+                return
+            elapsed = time() - pending["requested_at"]
+            if pending.get("boot_id") != self._boot_id():
+                # No RTC: after a reboot the clock may lag until NTP syncs, so uptime is the floor
+                try:
+                    elapsed = max(elapsed, self._read_uptime())
+                except OSError:
+                    pass
+            mode = pending.get("mode") or self._current_mode(agent)
+            if mode == "unknown" and agent is None:
+                # Too early to tell; the report is retried once the bot starts with the agent
+                return
+            text = f"\u2705 Back online after {int(elapsed)}s ({pending['action']}, mode: {mode})"
+            try:
+                bot = telegram.Bot(self.options["bot_token"])
+                if pending.get("message_id"):
+                    try:
+                        bot.edit_message_text(chat_id=pending["chat_id"], message_id=pending["message_id"], text=text)
+                    except telegram.error.BadRequest:
+                        bot.send_message(chat_id=pending["chat_id"], text=text)
+                else:
+                    bot.send_message(chat_id=pending["chat_id"], text=text)
+            except Exception as e:
+                # Leave the record for the next attempt (e.g. once the bot is connected)
+                self.logger.warning(f"[TelePwn] Could not report restart yet: {e}")
+                return
+            history = state.get("history", [])
+            history.append({"action": pending["action"], "seconds": int(elapsed), "mode": mode, "at": int(time())})
+            state["history"] = history[-RESTART_HISTORY_LIMIT:]
+            state.pop("pending", None)
+            self._save_restart_state(state)
+            self.logger.info(f"[TelePwn] {text}")
+
+    def restart_history(self, agent, update, context):
+        history = self._load_restart_state().get("history", [])
+        if not history:
+            self.send_message(update, context, "\u26a0 No restarts recorded yet.")
+            return
+        durations = sorted(entry["seconds"] for entry in history)
+        median = durations[len(durations) // 2]
+        lines = []
+        for entry in reversed(history):
+            slow = " \ud83d\udc22" if entry["seconds"] > median * 1.5 else ""
+            lines.append(f"{datetime.fromtimestamp(entry['at']):%Y-%m-%d %H:%M} {entry['action']}: {entry['seconds']}s ({entry['mode']}){slow}")
+        summary = f"avg {sum(durations) // len(durations)}s, median {median}s, max {durations[-1]}s"
+        self.send_message(update, context, f"\ud83d\udd01 Restart history ({summary}):\n" + "\n".join(lines))
+
     def reboot(self, agent, update, context):
         keyboard = [
             [InlineKeyboardButton("✅ Confirm Manual", callback_data="reboot_manual")],
@@ -465,21 +2541,31 @@ class TelePwn(plugins.Plugin):
         ]
         self.send_message(update, context, "\u26a0\ufe0f Confirm reboot? SSH/Bluetooth will disconnect.", keyboard)
 
+    def _after_display(self, show, action, update, context, failure):
+        # Let the e-ink draw the farewell message on a timer instead of sleeping on the dispatcher
+        def run():
+            try:
+                action()
+            except subprocess.CalledProcessError as e:
+                self.send_message(update, context, f"\u26d4 {failure}: {e}")
+
+        if view.ROOT:
+            show(view.ROOT)
+            timer = threading.Timer(DISPLAY_SETTLE_SECONDS, run)
+            timer.daemon = True
+            timer.start()
+        else:
+            run()
+
     def reboot_mode(self, mode, update, context):
-        self.send_message(update, context, f"\ud83d\udd04 Rebooting in {mode} mode...")
-        try:
-            if view.ROOT:
-                view.ROOT.on_custom(f"Rebooting to {mode}")
-                sleep(5)
-            subprocess.run(["sudo", "touch", f"/root/.pwnagotchi-{mode}"], check=True)
-            if mode == "manual":
-                subprocess.run(["sudo", "rm", "-f", "/root/.pwnagotchi-auto"], check=True)
-            else:
-                subprocess.run(["sudo", "rm", "-f", "/root/.pwnagotchi-manual"], check=True)
-            subprocess.run(["sudo", "sync"], check=True)
-            subprocess.run(["sudo", "reboot"], check=True)
-        except subprocess.CalledProcessError as e:
-            self.send_message(update, context, f"\u26d4 Reboot failed: {e}")
+        message = self.send_message(update, context, f"\ud83d\udd04 Rebooting in {mode} mode...")
+
+        def reboot():
+            self._set_mode(mode)
+            self._sync()
+            self._tracked_restart(f"reboot ({mode})", update, message, lambda: self._service("reboot"), mode)
+
+        self._after_display(lambda root: root.on_custom(f"Rebooting to {mode}"), reboot, update, context, "Reboot failed")
 
     def shutdown(self, agent, update, context):
         keyboard = [
@@ -491,20 +2577,35 @@ class TelePwn(plugins.Plugin):
     def confirm_shutdown(self, agent, update, context):
         self.send_message(update, context, "\ud83d\udce4 Stopping daemon, clearing screen, and shutting down...")
         try:
-            subprocess.run(["sudo", "systemctl", "stop", "pwnagotchi"], check=True)
+            self._service("stop")
             subprocess.run(["sudo", "pwnagotchi", "--clear"], check=True)
-            if view.ROOT:
-                view.ROOT.on_shutdown()
-                sleep(5)
-            subprocess.run(["sudo", "sync"], check=True)
-            subprocess.run(["sudo", "shutdown", "-h", "now"], check=True)
         except subprocess.CalledProcessError as e:
             self.send_message(update, context, f"\u26d4 Shutdown failed: {e}")
+            return
+
+        def poweroff():
+            self._sync()
+            self._service("poweroff")
+
+        self._after_display(lambda root: root.on_shutdown(), poweroff, update, context, "Shutdown failed")
+
+    def _read_uptime(self):
+        with open("/proc/uptime", "r", encoding="utf-8") as f:
+            return float(f.readline().split()[0])
+
+    def _read_temperature(self):
+        try:
+            with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
+                return int(f.read().strip()) / 1000
+        except (OSError, ValueError):
+            return "N/A"
+
+    def _count_handshakes(self):
+        return len([f for f in os.listdir(HANDSHAKE_DIR) if os.path.isfile(os.path.join(HANDSHAKE_DIR, f))])
 
     def uptime(self, agent, update, context):
         try:
-            with open("/proc/uptime", "r", encoding="utf-8") as f:
-                uptime_seconds = float(f.readline().split()[0])
+            uptime_seconds = self._read_uptime()
             hours = int(uptime_seconds // 3600)
             minutes = int((uptime_seconds % 3600) // 60)
             self.send_message(update, context, f"\u23f0 Uptime: {hours}h {minutes}m")
@@ -512,12 +2613,60 @@ class TelePwn(plugins.Plugin):
             self.send_message(update, context, f"\u26d4 Error: {e}")
 
     def handshake_count(self, agent, update, context):
+        if context.args and context.args[0].lower() == "summary":
+            self.handshake_summary(update, context)
+            return
         try:
-            count = len([f for f in os.listdir(HANDSHAKE_DIR) if os.path.isfile(os.path.join(HANDSHAKE_DIR, f))])
+            count = self._count_handshakes()
             self.send_message(update, context, f"\ud83e\udd1d Handshakes captured: {count}")
         except Exception as e:
             self.send_message(update, context, f"\u26d4 Error: {e}")
 
+    def _describe_capture(self, row):
+        name = html.escape(row["essid"] or os.path.basename(row["path"]))
+        details = []
+        if row["bssid"]:
+            details.append(row["bssid"])
+        if row["handshakes"]:
+            details.append(f"{row['handshakes']} handshake(s)")
+        if row["pmkid"]:
+            details.append("PMKID")
+        if row["status"] == "partial":
+            details.append(f"{row['eapol']} EAPOL frame(s)")
+        if row["error"]:
+            details.append(html.escape(row["error"]))
+        return f"{name} ({', '.join(details)})" if details else name
+
+    def handshake_summary(self, update, context):
+        try:
+            rows = sorted(self.captures.refresh().values(), key=lambda row: (row["essid"] or "").lower())
+        except OSError as e:
+            self.send_message(update, context, f"\u26d4 Error: {e}")
+            return
+        if not rows:
+            self.send_message(update, context, "\u26a0 No captures found in handshake directory.")
+            return
+        groups = {status: [row for row in rows if row["status"] == status] for status in CAPTURE_STATUS}
+        pmkids = sum(1 for row in groups["crackable"] if row["pmkid"])
+        lines = [
+            f"\ud83e\udd1d Handshake summary ({len(rows)} captures):",
+            f"{CAPTURE_STATUS['crackable']} Crackable: {len(groups['crackable'])} ({pmkids} with PMKID)",
+            f"{CAPTURE_STATUS['partial']} Partial: {len(groups['partial'])}",
+            f"{CAPTURE_STATUS['empty']} Empty: {len(groups['empty'])}",
+        ]
+        if groups["unreadable"]:
+            lines.append(f"{CAPTURE_STATUS['unreadable']} Unreadable: {len(groups['unreadable'])}")
+        duplicates = sum(len(rows) for group in self.captures.duplicates() for _, rows in group[1:])
+        if duplicates:
+            lines.append(f"\u267b\ufe0f Duplicates: {duplicates} (see /files dedupe)")
+        for status, title in (("crackable", "Crackable"), ("partial", "Partial"), ("unreadable", "Unreadable")):
+            if groups[status]:
+                lines.append(f"\n{title}:")
+                lines.extend(f"{CAPTURE_STATUS[status]} {self._describe_capture(row)}" for row in groups[status][:HANDSHAKE_SUMMARY_LIST])
+                if len(groups[status]) > HANDSHAKE_SUMMARY_LIST:
+                    lines.append(f"...and {len(groups[status]) - HANDSHAKE_SUMMARY_LIST} more")
+        self.send_message(update, context, "\n".join(lines))
+
     def take_screenshot(self, agent, update, context):
         try:
             context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_photo")
@@ -535,28 +2684,11 @@ class TelePwn(plugins.Plugin):
         try:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_path = f"/home/pi/telepwn_backup_{timestamp}.tar.gz"
-            backup_files = [
-                "/root/settings.yaml",
-                "/root/client_secrets.json",
-                "/home/pi/handshakes/",
-                "/root/.api-report.json",
-                "/root/.ssh",
-                "/root/.bashrc",
-                "/root/.profile",
-                "/root/peers",
-                "/etc/pwnagotchi/",
-                "/usr/local/share/pwnagotchi/custom-plugins",
-                "/etc/ssh/",
-                "/home/pi/.bashrc",
-                "/home/pi/.profile",
-                "/root/.auto-update",
-                "/home/pi/.wpa_sec_Uploads",
-            ]
-            existing_files = [f for f in backup_files if os.path.exists(f)]
+            existing_files = [f for f in BACKUP_FILES if os.path.exists(f)]
             if not existing_files:
                 self.send_message(update, context, "\u26a0 No files found to back up.")
                 return
-            subprocess.run(["sudo", "tar", "czf", backup_path] + existing_files, check=True)
+            self._archive(backup_path, existing_files)
             size_mb = round(os.path.getsize(backup_path) / (1024 * 1024), 2)
             with open(backup_path, "rb") as backup:
                 context.bot.send_document(chat_id=update.effective_chat.id, document=backup)
@@ -567,33 +2699,27 @@ class TelePwn(plugins.Plugin):
             self.send_message(update, context, f"\u26d4 Error: {e}")
 
     def restart_manual(self, agent, update, context):
-        self.send_message(update, context, "\ud83d\udd01 Restarting daemon in manual mode...")
-        try:
-            if view.ROOT:
-                view.ROOT.on_custom("Restarting to manual")
-                sleep(5)
-            subprocess.run(["sudo", "touch", "/root/.pwnagotchi-manual"], check=True)
-            subprocess.run(["sudo", "rm", "-f", "/root/.pwnagotchi-auto"], check=True)
-            subprocess.run(["sudo", "systemctl", "restart", "pwnagotchi"], check=True)
-        except subprocess.CalledProcessError as e:
-            self.send_message(update, context, f"\u26d4 Restart failed: {e}")
+        message = self.send_message(update, context, "\ud83d\udd01 Restarting daemon in manual mode...")
+
+        def restart():
+            self._set_mode("manual")
+            self._tracked_restart("restart (manual)", update, message, lambda: self._service("restart"), "manual")
+
+        self._after_display(lambda root: root.on_custom("Restarting to manual"), restart, update, context, "Restart failed")
 
     def restart_auto(self, agent, update, context):
-        self.send_message(update, context, "\ud83d\udd01 Restarting daemon in auto mode...")
-        try:
-            if view.ROOT:
-                view.ROOT.on_custom("Restarting to auto")
-                sleep(5)
-            subprocess.run(["sudo", "touch", "/root/.pwnagotchi-auto"], check=True)
-            subprocess.run(["sudo", "rm", "-f", "/root/.pwnagotchi-manual"], check=True)
-            subprocess.run(["sudo", "systemctl", "restart", "pwnagotchi"], check=True)
-        except subprocess.CalledProcessError as e:
-            self.send_message(update, context, f"\u26d4 Restart failed: {e}")
+        message = self.send_message(update, context, "\ud83d\udd01 Restarting daemon in auto mode...")
+
+        def restart():
+            self._set_mode("auto")
+            self._tracked_restart("restart (auto)", update, message, lambda: self._service("restart"), "auto")
+
+        self._after_display(lambda root: root.on_custom("Restarting to auto"), restart, update, context, "Restart failed")
 
     def pwnkill(self, agent, update, context):
         self.send_message(update, context, "\ud83d\udde1\ufe0f Killing daemon...")
         try:
-            subprocess.run(["sudo", "killall", "-USR1", "pwnagotchi"], check=True)
+            self._reload_plugins()
             self.send_message(update, context, "\u2705 Daemon killed and plugins reloaded.", INITIAL_MENU)
         except subprocess.CalledProcessError as e:
             self.send_message(update, context, f"\u26d4 Kill failed: {e}")
@@ -604,7 +2730,6 @@ class TelePwn(plugins.Plugin):
             subprocess.run(["sudo", "pwnagotchi", "--clear"], check=True)
             if view.ROOT:
                 view.ROOT.on_custom("Screen cleared")
-                sleep(2)
             self.send_message(update, context, "\u2705 Screen cleared!")
         except subprocess.CalledProcessError as e:
             self.send_message(update, context, f"\u26d4 Clear failed: {e}")
@@ -617,28 +2742,111 @@ class TelePwn(plugins.Plugin):
         except subprocess.CalledProcessError as e:
             self.send_message(update, context, f"\u26d4 Log fetch failed: {e}")
 
-    def inbox(self, agent, update, context):
-        self.send_message(update, context, "\ud83d\udce5 Checking Pwngrid inbox...")
+    def log_search(self, agent, update, context):
+        if not context.args:
+            self.send_message(update, context, "Usage: /logsearch <regex> [since] [until]\nTimes: 30m, 2h, 1d, today, yesterday, HH:MM, YYYY-MM-DD or YYYY-MM-DDTHH:MM\nExample: /logsearch bettercap.*restart yesterday today")
+            return
         try:
-            inbox_output = subprocess.check_output(["pwngrid", "--inbox"], text=True)
-            msg = f"\ud83d\udce5 Pwngrid Inbox:\n```\n{inbox_output}\n```"
-            self.send_message(update, context, msg)
-        except subprocess.CalledProcessError as e:
+            pattern = re.compile(context.args[0])
+            since = parse_time_arg(context.args[1]) if len(context.args) > 1 else None
+            until = parse_time_arg(context.args[2]) if len(context.args) > 2 else None
+        except (re.error, ValueError) as e:
+            self.send_message(update, context, f"\u26d4 Invalid search: {e}")
+            return
+
+        self.send_message(update, context, "\ud83d\udd0e Searching logs...")
+        try:
+            matches, truncated = self.log_index.search(pattern, since, until)
+        except Exception as e:
+            self.send_message(update, context, f"\u26d4 Log search failed: {e}")
+            return
+        if not matches:
+            self.send_message(update, context, "\u26a0 No matching log lines.")
+            return
+        note = f" (stopped at {LOG_SEARCH_MAX_MATCHES})" if truncated else ""
+        pages = paginate_lines(matches, LOG_SEARCH_PAGE_SIZE, LOG_SEARCH_PAGE_CHARS)
+        if len(pages) > LOG_SEARCH_MAX_PAGES:
+            self._send_report(update, context, "\n".join(matches) + "\n", "telepwn_logsearch.txt")
+            self.send_message(update, context, f"\u2705 {len(matches)} matching lines{note}, sent as a file.")
+            return
+        results = self.pending.put(update.effective_chat.id, "logsearch_results", (len(matches), pages), single_use=False)
+        self.log_search_page(update, context, results, 0)
+
+    def log_search_page(self, update, context, results, page):
+        chat_id = update.effective_chat.id
+        if self.pending.peek(chat_id, results) != "logsearch_results":
+            self.send_message(update, context, "\u26a0 These search results have expired. Please search again.")
+            return
+        total, chunks = self.pending.take(chat_id, results)[1]
+        pages = len(chunks)
+        page = max(0, min(page, pages - 1))
+        lines = chunks[page]
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"t:{self.pending.put(chat_id, 'logsearch_page', (results, page - 1))}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"t:{self.pending.put(chat_id, 'logsearch_page', (results, page + 1))}"))
+        text = f"\ud83d\udd0e {total} matching lines (page {page + 1}/{pages}):\n```\n" + html.escape("\n".join(lines)) + "\n```"
+        self.send_message(update, context, text, [nav] if nav else None)
+
+    def inbox(self, agent, update, context, page=0, refresh=False):
+        with self.inbox_lock:
+            stale = self.inbox_fetched_at is None
+        try:
+            if refresh or stale:
+                self.refresh_inbox()
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
             self.send_message(update, context, f"\u26d4 Inbox fetch failed: {e}")
+            return
 
-    def plugins_menu(self, agent, update, context):
+        with self.inbox_lock:
+            messages = list(self.inbox_messages)
+            # The poller may invalidate the cache again at any moment, so read it once here
+            fetched_at = self.inbox_fetched_at
+        chat_id = update.effective_chat.id
+        keyboard = []
+        if not messages:
+            text = "\ud83d\udce5 Pwngrid inbox is empty."
+        else:
+            pages = (len(messages) + INBOX_PAGE_SIZE - 1) // INBOX_PAGE_SIZE
+            page = max(0, min(page, pages - 1))
+            lines = [self._format_inbox_message(m) for m in messages[page * INBOX_PAGE_SIZE:(page + 1) * INBOX_PAGE_SIZE]]
+            text = f"\ud83d\udce5 Pwngrid Inbox ({len(messages)} messages, page {page + 1}/{pages}):\n" + "\n".join(lines)
+            nav = []
+            if page > 0:
+                nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"t:{self.pending.put(chat_id, 'inbox_page', page - 1)}"))
+            if page < pages - 1:
+                nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"t:{self.pending.put(chat_id, 'inbox_page', page + 1)}"))
+            if nav:
+                keyboard.append(nav)
+        text += f"\n(updated {int(time() - fetched_at)}s ago)" if fetched_at is not None else "\n(update pending, press Refresh)"
+        keyboard.append([InlineKeyboardButton("🔄 Refresh", callback_data=f"t:{self.pending.put(chat_id, 'inbox_refresh')}")])
+        self.send_message(update, context, text, keyboard)
+
+    def plugins_menu(self, agent, update, context, page=0):
         plugins_found = self.get_plugins()
         if not plugins_found:
             self.send_message(update, context, "\u26a0 No plugins found.")
             return
 
+        chat_id = update.effective_chat.id
+        pages = (len(plugins_found) + PLUGINS_PER_PAGE - 1) // PLUGINS_PER_PAGE
+        page = max(0, min(page, pages - 1))
         keyboard = []
-        for plugin in plugins_found:
+        for plugin in plugins_found[page * PLUGINS_PER_PAGE:(page + 1) * PLUGINS_PER_PAGE]:
             state = self.plugin_states.get(plugin, False)
             emoji = "✅" if state else "❌"
-            keyboard.append([InlineKeyboardButton(f"{emoji} {plugin}", callback_data=f"toggle_plugin_{plugin}")])
-        keyboard.append([InlineKeyboardButton("Back", callback_data="start")])
-        self.send_message(update, context, "\ud83d\udd27 Toggle Plugins:", keyboard)
+            token = self.pending.put(chat_id, "toggle_plugin", plugin)
+            keyboard.append([InlineKeyboardButton(f"{emoji} {plugin}", callback_data=f"t:{token}")])
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"t:{self.pending.put(chat_id, 'plugins_page', page - 1)}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"t:{self.pending.put(chat_id, 'plugins_page', page + 1)}"))
+        if nav:
+            keyboard.append(nav)
+        keyboard.append([InlineKeyboardButton("Back", callback_data="show_menu")])
+        self.send_message(update, context, f"\ud83d\udd27 Toggle Plugins ({page + 1}/{pages}):", keyboard)
 
     def get_plugins(self):
         plugins_found = set()
@@ -679,33 +2887,35 @@ class TelePwn(plugins.Plugin):
             self.send_message(update, context, f"\u26d4 Plugin {plugin_name} not found.")
             return
 
-        self.toggle_plugin(agent, update, context, plugin_name)
+        self._run_action("toggle_plugin", self.toggle_plugin, agent, update, context, plugin_name)
 
     def toggle_plugin(self, agent, update, context, plugin_name):
-        current_state = self.plugin_states.get(plugin_name, False)
-        new_state = not current_state
-        self.send_message(update, context, f"\ud83d\udd27 Toggling {plugin_name} to {'enabled' if new_state else 'disabled'}...")
-        try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                config = toml.load(f)
+        # Button presses run concurrently; hold the lock so two toggles cannot lose an edit
+        with self.config_lock:
+            current_state = self.plugin_states.get(plugin_name, False)
+            new_state = not current_state
+            self.send_message(update, context, f"\ud83d\udd27 Toggling {plugin_name} to {'enabled' if new_state else 'disabled'}...")
+            try:
+                with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+                    config = toml.load(f)
 
-            if "main" not in config:
-                config["main"] = {}
-            if "plugins" not in config["main"]:
-                config["main"]["plugins"] = {}
+                if "main" not in config:
+                    config["main"] = {}
+                if "plugins" not in config["main"]:
+                    config["main"]["plugins"] = {}
 
-            if plugin_name not in config["main"]["plugins"]:
-                config["main"]["plugins"][plugin_name] = {}
-            config["main"]["plugins"][plugin_name]["enabled"] = new_state
+                if plugin_name not in config["main"]["plugins"]:
+                    config["main"]["plugins"][plugin_name] = {}
+                config["main"]["plugins"][plugin_name]["enabled"] = new_state
 
-            with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-                toml.dump(config, f)
+                with open(CONFIG_FILE, "w", encoding="utf-8") as f:
+                    toml.dump(config, f)
 
-            self.plugin_states[plugin_name] = new_state
-            subprocess.run(["sudo", "killall", "-USR1", "pwnagotchi"], check=True)
-            self.send_message(update, context, f"\u2705 {plugin_name} {'enabled' if new_state else 'disabled'}. Plugins reloaded.")
-        except Exception as e:
-            self.send_message(update, context, f"\u26d4 Failed to toggle {plugin_name}: {e}")
+                self.plugin_states[plugin_name] = new_state
+                self._reload_plugins()
+                self.send_message(update, context, f"\u2705 {plugin_name} {'enabled' if new_state else 'disabled'}. Plugins reloaded.")
+            except Exception as e:
+                self.send_message(update, context, f"\u26d4 Failed to toggle {plugin_name}: {e}")
 
     def set_webhook(self, agent, update, context):
         if len(context.args) < 2:
@@ -713,6 +2923,13 @@ class TelePwn(plugins.Plugin):
             return
 
         action = context.args[0].strip()
+        if context.args[1].strip() == "delete":
+            if self.store.delete_webhook(action):
+                self.webhooks.pop(action, None)
+                self.send_message(update, context, f"\u2705 Webhook {action} deleted")
+            else:
+                self.send_message(update, context, f"\u26d4 No webhook named {action}")
+            return
         url = context.args[1].strip() if context.args[1].strip() != "none" else ""
         action_type = context.args[2].strip() if len(context.args) > 2 else "notify"
         extra = " ".join(context.args[3:]).strip() if len(context.args) > 3 else ""
@@ -726,18 +2943,19 @@ class TelePwn(plugins.Plugin):
                     self.send_message(update, context, "\u26d4 Invalid HTTP request format. Expected format: METHOD <URL>")
                     return
 
-            self.webhooks[action] = {"url": url, "type": action_type}
+            webhook_config = {"url": url, "type": action_type}
             if action_type == "http" and extra:
-                self.webhooks[action]["request"] = extra
+                webhook_config["request"] = extra
             elif action_type == "shell" and extra:
-                self.webhooks[action]["command"] = extra
+                webhook_config["command"] = extra
             elif action_type in ("plugin_toggle", "notify"):
                 pass
             else:
                 self.send_message(update, context, "\u26d4 Invalid type or missing request/command")
                 return
 
-            self._save_webhooks()
+            self.store.put_webhook(action, webhook_config)
+            self.webhooks[action] = webhook_config
             self.send_message(update, context, f"\u2705 Webhook set for {action}: {url if url else 'none'}")
             self.logger.info(f"[TelePwn] Webhook set in memory: {self.webhooks}")
         except Exception as e:
@@ -751,7 +2969,9 @@ class TelePwn(plugins.Plugin):
 
         action = context.args[0].strip()
         extra = " ".join(context.args[1:]).strip() if len(context.args) > 1 else ""
+        self._run_webhook(agent, update, context, action, extra)
 
+    def _run_webhook(self, agent, update, context, action, extra, event=None):
         if action not in self.webhooks:
             self.send_message(update, context, f"\u26d4 No webhook set for {action}")
             return
@@ -818,11 +3038,14 @@ class TelePwn(plugins.Plugin):
                 return
 
             if action_type != "plugin_toggle" and webhook_config.get("url"):
-                self.trigger_webhook(action, {
+                payload = {
                     "action": action,
                     "extra": extra,
                     "chat_id": update.effective_chat.id
-                })
+                }
+                if event:
+                    payload["event"] = {key: value for key, value in event.items() if key != "at"}
+                self.trigger_webhook(action, payload)
         except subprocess.CalledProcessError as e:
             error_msg = f"\u26d4 {action} failed:\nError:\n```\n{e.stderr}\n```"
             self.send_message(update, context, error_msg)
@@ -831,98 +3054,601 @@ class TelePwn(plugins.Plugin):
             self.send_message(update, context, f"\u26d4 {action} failed: {str(e)}")
             self.logger.error(f"[TelePwn] Webhook {action} failed: {e}")
 
+    def trigger_webhook(self, action, payload):
+        # Chat services (Discord, Slack) show "content"/"text"; anything else gets the JSON fields
+        body = dict(payload, content=f"TelePwn: {action} triggered", text=f"TelePwn: {action} triggered")
+        response = requests.post(self.webhooks[action]["url"], json=body, timeout=5)
+        response.raise_for_status()
+
     def config_editor(self, agent, update, context):
         if not context.args:
-            self.send_message(update, context, "Usage:\n/config view <section> <key>\n/config set <section> <key> <value>\n/config list\nExample: /config set main.plugins.memtemp enabled true")
+            self.send_message(update, context, "Usage:\n/config view <section> <key>\n/config set <section> <key> <value>\n/config list [section]\n/config find <text>\n/config complete <prefix>\n/config diff\n/config apply\n/config discard\nExample: /config set main.plugins.memtemp enabled true")
             return
 
         action = context.args[0].lower()
         try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                config = toml.load(f)
-
-            if action == "list":
-                msg = "Config sections and keys:\n"
-                for section, values in config.items():
-                    msg += f"\n[{section}]\n"
-                    if isinstance(values, dict):
-                        for key, val in values.items():
-                            if isinstance(val, dict):
-                                for subkey, subval in val.items():
-                                    msg += f"  {key}.{subkey} = {subval}\n"
-                            else:
-                                msg += f"  {key} = {val}\n"
-                self.send_message(update, context, msg)
-                return
-
-            if len(context.args) < 3:
-                self.send_message(update, context, "Please provide section and key.")
-                return
-
-            section = context.args[1]
-            key_path = context.args[2].split(".")
-            if action == "view":
-                current = config
-                for key in section.split("."):
-                    current = current.get(key, {})
-                for key in key_path:
-                    current = current.get(key, None)
-                    if current is None:
-                        self.send_message(update, context, f"\u26d4 Key {section}.{context.args[2]} not found.")
-                        return
-                self.send_message(update, context, f"\ud83d\udd0d {section}.{context.args[2]} = {current}")
-            elif action == "set":
+            self.config_index.refresh()
+            if action in ("list", "browse"):
+                self.config_browse(update, context, context.args[1] if len(context.args) > 1 else "", 0)
+            elif action == "find":
+                if len(context.args) < 2:
+                    self.send_message(update, context, "Please provide text to search for.")
+                    return
+                matches = self.config_index.find(" ".join(context.args[1:]))
+                if not matches:
+                    self.send_message(update, context, f"\u26a0 No keys matching {html.escape(context.args[1])}.")
+                    return
+                lines = [f"{html.escape(key)} = {self._preview(self.config_index.get(key))}" for key in matches[:CONFIG_PAGE_SIZE]]
+                more = f"\n...and {len(matches) - CONFIG_PAGE_SIZE} more" if len(matches) > CONFIG_PAGE_SIZE else ""
+                self.send_message(update, context, f"\ud83d\udd0d {len(matches)} matching keys:\n" + "\n".join(lines) + more)
+            elif action == "complete":
+                self.config_complete(update, context, context.args[1] if len(context.args) > 1 else "")
+            elif action == "diff":
+                self.config_diff(update, context)
+            elif action == "apply":
+                self.config_apply(update, context)
+            elif action == "discard":
+                self.config_discard(update, context)
+            elif action in ("view", "set"):
+                if len(context.args) < 3:
+                    self.send_message(update, context, "Please provide section and key.")
+                    return
+                key = f"{context.args[1]}.{context.args[2]}"
+                if action == "view":
+                    self.config_view(update, context, key)
+                    return
                 if len(context.args) < 4:
                     self.send_message(update, context, "Please provide a value to set.")
                     return
-                value = context.args[3].lower()
-                if value in ("true", "false"):
-                    value = value == "true"
-                elif value.isdigit():
-                    value = int(value)
-                elif value.replace(".", "").isdigit():
-                    value = float(value)
-
-                current = config
-                sections = section.split(".")
-                for i, key in enumerate(sections[:-1]):
-                    if key not in current:
-                        current[key] = {}
-                    current = current[key]
-                last_section = sections[-1]
-                if last_section not in current:
-                    current[last_section] = {}
-
-                target = current[last_section]
-                for key in key_path[:-1]:
-                    if key not in target:
-                        target[key] = {}
-                    target = target[key]
-                target[key_path[-1]] = value
+                edits = self.config_edits.setdefault(update.effective_chat.id, {})
+                conflict = self.config_index.conflict(key)
+                if conflict is None:
+                    conflict = next((k for k in edits if key.startswith(f"{k}.") or k.startswith(f"{key}.")), None)
+                if conflict == key:
+                    self.send_message(update, context, f"\u26d4 {html.escape(key)} is a section. Set the keys inside it instead.")
+                    return
+                if conflict:
+                    self.send_message(update, context, f"\u26d4 Cannot set {html.escape(key)}: {html.escape(conflict)} holds a value, not a section.")
+                    return
+                edits[key] = self._parse_config_value(" ".join(context.args[3:]))
+                self.config_diff(update, context)
+            else:
+                self.send_message(update, context, "Invalid action. Use 'view', 'set', 'list', 'find', 'complete', 'diff', 'apply' or 'discard'.")
+        except Exception as e:
+            self.send_message(update, context, f"\u26d4 Failed to edit config: {html.escape(str(e))}")
+
+    def _parse_config_value(self, raw):
+        lowered = raw.lower()
+        if lowered in ("true", "false"):
+            return lowered == "true"
+        if raw.isdigit():
+            return int(raw)
+        if raw.replace(".", "", 1).isdigit():
+            return float(raw)
+        return raw
+
+    def _preview(self, value):
+        # Config values are arbitrary text; escape them for the HTML parse mode after cutting
+        text = repr(value) if isinstance(value, str) else str(value)
+        return html.escape(text if len(text) <= CONFIG_VALUE_PREVIEW else text[:CONFIG_VALUE_PREVIEW - 3] + "...")
+
+    def config_view(self, update, context, key):
+        index = self.config_index.refresh()
+        if key in index.values:
+            self.send_message(update, context, f"\ud83d\udd0d {html.escape(key)} = {escape_truncated(str(index.get(key)), MAX_MESSAGE_LENGTH)}")
+            return
+        if index.with_prefix(f"{key}."):
+            self.config_browse(update, context, key, 0)
+            return
+        self.send_message(update, context, f"\u26d4 Key {html.escape(key)} not found.")
 
-                with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-                    toml.dump(config, f)
-                self.send_message(update, context, f"\u2705 Set {section}.{context.args[2]} = {value}")
-                subprocess.run(["sudo", "systemctl", "restart", "pwnagotchi"], check=True)
-                self.send_message(update, context, "\u2705 Pwnagotchi restarted to apply changes.")
+    def config_browse(self, update, context, section, page):
+        index = self.config_index.refresh()
+        subsections, leaves = index.children(section)
+        if not subsections and not leaves:
+            self.send_message(update, context, f"\u26d4 Section {html.escape(section)} not found.")
+            return
+        chat_id = update.effective_chat.id
+        # Leaves and subsection buttons share one page counter
+        pages = max(1, (len(leaves) + CONFIG_PAGE_SIZE - 1) // CONFIG_PAGE_SIZE, (len(subsections) + CONFIG_BUTTONS_PER_PAGE - 1) // CONFIG_BUTTONS_PER_PAGE)
+        page = max(0, min(page, pages - 1))
+        lines = [f"{html.escape(key[len(section) + 1 if section else 0:])} = {self._preview(index.get(key))}" for key in leaves[page * CONFIG_PAGE_SIZE:(page + 1) * CONFIG_PAGE_SIZE]]
+        keyboard = []
+        for sub in subsections[page * CONFIG_BUTTONS_PER_PAGE:(page + 1) * CONFIG_BUTTONS_PER_PAGE]:
+            label = sub[len(section) + 1 if section else 0:]
+            keyboard.append([InlineKeyboardButton(f"📂 {label}", callback_data=f"t:{self.pending.put(chat_id, 'config_browse', (sub, 0))}")])
+        nav = []
+        if section:
+            parent = section.rsplit(".", 1)[0] if "." in section else ""
+            nav.append(InlineKeyboardButton("⬆️ Up", callback_data=f"t:{self.pending.put(chat_id, 'config_browse', (parent, 0))}"))
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"t:{self.pending.put(chat_id, 'config_browse', (section, page - 1))}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"t:{self.pending.put(chat_id, 'config_browse', (section, page + 1))}"))
+        if nav:
+            keyboard.append(nav)
+        title = f"[{html.escape(section)}]" if section else "config.toml"
+        text = f"\u2699\ufe0f {title} ({page + 1}/{pages})"
+        if lines:
+            text += "\n" + "\n".join(lines)
+        self.send_message(update, context, text, keyboard)
+
+    def config_complete(self, update, context, prefix):
+        index = self.config_index.refresh()
+        completions = index.complete(prefix)
+        if not completions:
+            self.send_message(update, context, f"\u26a0 No keys start with {html.escape(prefix)}.")
+            return
+        chat_id = update.effective_chat.id
+        keyboard = []
+        for candidate, leaf in completions[:CONFIG_BUTTONS_PER_PAGE]:
+            if leaf:
+                keyboard.append([InlineKeyboardButton(f"🔑 {candidate}", callback_data=f"t:{self.pending.put(chat_id, 'config_view', candidate)}")])
+            else:
+                keyboard.append([InlineKeyboardButton(f"📂 {candidate}.", callback_data=f"t:{self.pending.put(chat_id, 'config_complete', candidate + '.')}")])
+        more = f" (showing {CONFIG_BUTTONS_PER_PAGE} of {len(completions)})" if len(completions) > CONFIG_BUTTONS_PER_PAGE else ""
+        self.send_message(update, context, f"\ud83d\udd0d Completions for {html.escape(prefix) or 'config'}{more}:", keyboard)
+
+    def config_diff(self, update, context):
+        edits = self.config_edits.get(update.effective_chat.id)
+        if not edits:
+            self.send_message(update, context, "\u26a0 No pending config edits.")
+            return
+        index = self.config_index.refresh()
+        lines = []
+        for key, value in edits.items():
+            current = self._preview(index.get(key)) if key in index.values else "(unset)"
+            lines.append(f"{html.escape(key)}: {current} → {self._preview(value)}")
+        chat_id = update.effective_chat.id
+        keyboard = [
+            [InlineKeyboardButton("✅ Apply & restart", callback_data=f"t:{self.pending.put(chat_id, 'config_apply')}")],
+            [InlineKeyboardButton("❌ Discard", callback_data=f"t:{self.pending.put(chat_id, 'config_discard')}")],
+        ]
+        self.send_message(update, context, "\ud83d\udcdd Pending config edits:\n" + "\n".join(lines), keyboard)
+
+    def config_discard(self, update, context):
+        self.config_edits.pop(update.effective_chat.id, None)
+        self.send_message(update, context, "\u2705 Pending config edits discarded.")
+
+    def config_apply(self, update, context):
+        # Staged edits stay put until the file is written, so a failed apply can be fixed and retried
+        edits = self.config_edits.get(update.effective_chat.id)
+        if not edits:
+            self.send_message(update, context, "\u26a0 No pending config edits.")
+            return
+        try:
+            with self.config_lock:
+                with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+                    config = toml.load(f)
+                for key, value in edits.items():
+                    target = config
+                    parts = key.split(".")
+                    for i, part in enumerate(parts[:-1]):
+                        if part not in target:
+                            target[part] = {}
+                        elif not isinstance(target[part], dict):
+                            # The file changed since the edit was staged; never replace a value with a table
+                            raise ValueError(f"{'.'.join(parts[:i + 1])} holds a value, not a section")
+                        target = target[part]
+                    if isinstance(target.get(parts[-1]), dict):
+                        raise ValueError(f"{key} is a section")
+                    target[parts[-1]] = value
+                # Write a sibling file and swap it in, so a failed dump never leaves config.toml truncated
+                fd, partial = tempfile.mkstemp(dir=os.path.dirname(CONFIG_FILE), prefix=".config-", suffix=".partial")
+                try:
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        toml.dump(config, f)
+                    shutil.copymode(CONFIG_FILE, partial)
+                    os.replace(partial, CONFIG_FILE)
+                finally:
+                    if os.path.exists(partial):
+                        os.remove(partial)
+                self.config_edits.pop(update.effective_chat.id, None)
+            message = self.send_message(update, context, f"\u2705 Applied {len(edits)} config edit(s). Restarting pwnagotchi...")
+            self._tracked_restart("config change", update, message, lambda: self._service("restart"))
         except Exception as e:
-            self.send_message(update, context, f"\u26d4 Failed to edit config: {e}")
+            self.send_message(update, context, f"\u26d4 Failed to apply config edits: {html.escape(str(e))}\nThe edits are still pending; fix them with /config set or drop them with /config discard.")
 
     def system_stats(self, agent, update, context):
         try:
             cpu_usage = psutil.cpu_percent(interval=1)
             memory = psutil.virtual_memory()
             memory_usage = memory.percent
-            try:
-                with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-                    temp = int(f.read().strip()) / 1000
-            except:
-                temp = "N/A"
+            temp = self._read_temperature()
             msg = f"\ud83d\udcca System Stats:\nCPU Usage: {cpu_usage}%\nMemory Usage: {memory_usage}%\nTemperature: {temp}°C"
             self.send_message(update, context, msg)
         except Exception as e:
             self.send_message(update, context, f"\u26d4 Failed to fetch stats: {e}")
 
+    def _load_dashboard_message(self):
+        return self.store.get("dashboard.message_id")
+
+    def _save_dashboard_message(self):
+        try:
+            if self.dashboard_message_id:
+                self.store.set("dashboard.message_id", self.dashboard_message_id)
+            else:
+                self.store.delete("dashboard.message_id")
+        except Exception as e:
+            self.logger.error(f"[TelePwn] Failed to save dashboard state: {e}")
+
+    def dashboard_command(self, agent, update, context):
+        action = context.args[0].lower() if context.args else "on"
+        if action == "on":
+            if self.dashboard_running:
+                self.dashboard_wake.set()
+                self.send_message(update, context, "\u2705 Dashboard refreshed.")
+            else:
+                self.start_dashboard(agent)
+                self.send_message(update, context, f"\u2705 Dashboard started (every {self.options['dashboard_interval']}s).")
+        elif action == "off":
+            self.stop_dashboard(unpin=True)
+            self.send_message(update, context, "\u2705 Dashboard stopped.")
+        else:
+            self.send_message(update, context, "Usage: /dashboard [on|off]")
+
+    def start_dashboard(self, agent):
+        if self.dashboard_running:
+            return
+        self.agent = agent
+        self.dashboard_running = True
+        self.dashboard_wake.clear()
+        self.dashboard_thread = threading.Thread(target=self.run_dashboard, daemon=True)
+        self.dashboard_thread.start()
+        self.logger.info("[TelePwn] Dashboard started.")
+
+    def stop_dashboard(self, unpin=False):
+        if not self.dashboard_running:
+            return
+        self.dashboard_running = False
+        self.dashboard_wake.set()
+        if self.dashboard_thread and self.dashboard_thread is not threading.current_thread():
+            self.dashboard_thread.join()
+        self.dashboard_thread = None
+        if unpin and self.dashboard_message_id:
+            try:
+                telegram.Bot(self.options["bot_token"]).unpin_chat_message(
+                    chat_id=int(self.options["chat_id"]), message_id=self.dashboard_message_id)
+            except Exception as e:
+                self.logger.warning(f"[TelePwn] Failed to unpin dashboard: {e}")
+            self.dashboard_message_id = None
+            self.dashboard_text = None
+            self._save_dashboard_message()
+        self.logger.info("[TelePwn] Dashboard stopped.")
+
+    def run_dashboard(self):
+        interval = self.options.get("dashboard_interval", 120)
+        bot = telegram.Bot(self.options["bot_token"])
+        if self.dashboard_message_id is None:
+            self.dashboard_message_id = self._load_dashboard_message()
+        psutil.cpu_percent(interval=None)  # Prime the counter; later calls cover the whole interval
+        delay = 1
+        while self.dashboard_running:
+            self.dashboard_wake.wait(delay)
+            self.dashboard_wake.clear()
+            if not self.dashboard_running:
+                break
+            try:
+                self.update_dashboard(bot)
+                delay = interval
+            except telegram.error.RetryAfter as e:
+                delay = min(DASHBOARD_MAX_BACKOFF, e.retry_after + interval)
+                self.logger.warning(f"[TelePwn] Dashboard rate limited, backing off {delay}s")
+            except telegram.error.BadRequest as e:
+                # The pinned message was deleted; post a fresh one next round
+                self.logger.warning(f"[TelePwn] Dashboard edit rejected: {e}")
+                self.dashboard_message_id = None
+                self.dashboard_text = None
+                delay = interval
+            except Exception as e:
+                delay = min(DASHBOARD_MAX_BACKOFF, delay * 2)
+                self.logger.error(f"[TelePwn] Dashboard update failed: {e}")
+
+    def update_dashboard(self, bot):
+        text = self._render_dashboard()
+        if text == self.dashboard_text:
+            return False
+        chat_id = int(self.options["chat_id"])
+        if self.dashboard_message_id is None:
+            message = bot.send_message(chat_id=chat_id, text=text, disable_notification=True)
+            self.dashboard_message_id = message.message_id
+            self._save_dashboard_message()
+            bot.pin_chat_message(chat_id=chat_id, message_id=message.message_id, disable_notification=True)
+        else:
+            try:
+                bot.edit_message_text(chat_id=chat_id, message_id=self.dashboard_message_id, text=text)
+            except telegram.error.BadRequest as e:
+                # After a restart the cached text is gone; an identical edit is not an error
+                if "not modified" not in str(e).lower():
+                    raise
+        self.dashboard_text = text
+        return True
+
+    def _render_dashboard(self):
+        # Values are coarsened so the text, and thus the edit, only changes when something real does
+        uptime_seconds = self._read_uptime()
+        boot = datetime.fromtimestamp(time() - uptime_seconds)
+        cpu = int(round(psutil.cpu_percent(interval=None) / 5.0) * 5)
+        memory = int(round(psutil.virtual_memory().percent / 5.0) * 5)
+        temp = self._read_temperature()
+        temp = f"{temp:.0f}°C" if isinstance(temp, float) else temp
+        try:
+            mode = self.agent.view().get("mode") or "?"
+        except Exception:
+            mode = "?"
+        if self.last_capture:
+            last = f"{self.last_capture[1]} at {datetime.fromtimestamp(self.last_capture[0]):%H:%M}"
+        else:
+            last = "none yet"
+        return (
+            "\ud83d\udcca TelePwn Dashboard\n"
+            f"\u23f0 Up since {boot:%Y-%m-%d %H:%M} ({int(uptime_seconds // 3600)}h)\n"
+            f"\ud83e\udd1d Handshakes: {self._count_handshakes()}\n"
+            f"\ud83d\udda5 CPU ~{cpu}% | RAM ~{memory}% | {temp}\n"
+            f"\u2699\ufe0f Mode: {mode}\n"
+            f"\ud83c\udfaf Last capture: {last}"
+        )
+
+    def profile_command(self, agent, update, context):
+        if update.effective_chat.id != int(self.options.get("chat_id")):
+            return
+        if not self.options.get("profiling", False):
+            self.send_message(update, context, "\u26d4 Profiling is disabled. Set main.plugins.telepwn.profiling = true to enable it.")
+            return
+        if not context.args:
+            self.send_message(update, context, f"Usage:\n/profile cpu <seconds>\n/profile mem\n/profile mem stop\nExample: /profile cpu 30 (max {PROFILE_MAX_SECONDS}s)")
+            return
+
+        action = context.args[0].lower()
+        if action == "mem" and len(context.args) > 1 and context.args[1].lower() == "stop":
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self.mem_snapshot = None
+            self.send_message(update, context, "\u2705 Memory tracing stopped.")
+            return
+
+        # Profiling itself allocates; don't push a struggling unit over the edge
+        free_mb = psutil.virtual_memory().available / (1024 * 1024)
+        if free_mb < PROFILE_MIN_FREE_MB:
+            self.send_message(update, context, f"\u26d4 Only {free_mb:.0f} MB free (need {PROFILE_MIN_FREE_MB} MB). Refusing to profile.")
+            return
+
+        if action == "cpu":
+            try:
+                seconds = int(context.args[1]) if len(context.args) > 1 else 10
+            except ValueError:
+                self.send_message(update, context, "Please provide the duration in seconds.")
+                return
+            seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+            if not self.profile_lock.acquire(blocking=False):
+                self.send_message(update, context, "\u26a0 A CPU profile is already running.")
+                return
+            self.send_message(update, context, f"\u23f1 Profiling all threads for {seconds}s...")
+            threading.Thread(target=self._run_cpu_profile, args=(update, context, seconds), daemon=True).start()
+        elif action == "mem":
+            self._run_memory_profile(update, context)
+        else:
+            self.send_message(update, context, "Invalid action. Use 'cpu' or 'mem'.")
+
+    def _run_cpu_profile(self, update, context, seconds):
+        try:
+            if sys.version_info >= (3, 12):
+                report = self._cprofile_all_threads(seconds)
+            else:
+                report = self._sample_all_threads(seconds)
+            self._send_report(update, context, report, "telepwn_profile_cpu.txt")
+        except Exception as e:
+            self.logger.error(f"[TelePwn] CPU profile failed: {e}")
+            self.send_message(update, context, f"\u26d4 CPU profile failed: {e}")
+        finally:
+            self.profile_lock.release()
+
+    def _cprofile_all_threads(self, seconds):
+        # Since 3.12 cProfile hooks sys.monitoring, which covers every thread
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            sleep(seconds)
+        finally:
+            profiler.disable()
+
+        out = io.StringIO()
+        out.write(f"cProfile over {seconds}s, threads: {', '.join(sorted(t.name for t in threading.enumerate()))}\n\n")
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_ENTRIES)
+        stats.sort_stats("tottime").print_stats(PROFILE_TOP_ENTRIES)
+        return out.getvalue()
+
+    def _sample_all_threads(self, seconds):
+        # Python < 3.12 can't install cProfile into already running threads,
+        # so fall back to sampling every thread's stack instead.
+        own_ident = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        own_counts, cumulative_counts, thread_counts = {}, {}, {}
+        samples = 0
+        deadline = time() + seconds
+        while time() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                name = names.get(ident, str(ident))
+                thread_counts[name] = thread_counts.get(name, 0) + 1
+                seen = set()
+                top = True
+                while frame is not None:
+                    code = frame.f_code
+                    key = f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+                    if top:
+                        own_counts[key] = own_counts.get(key, 0) + 1
+                        top = False
+                    if key not in seen:
+                        cumulative_counts[key] = cumulative_counts.get(key, 0) + 1
+                        seen.add(key)
+                    frame = frame.f_back
+            samples += 1
+            sleep(PROFILE_SAMPLE_INTERVAL)
+
+        out = io.StringIO()
+        out.write(f"Stack sampling over {seconds}s ({samples} samples, cProfile needs Python 3.12+ for all threads)\n\n")
+        out.write("Samples per thread:\n")
+        for name, count in sorted(thread_counts.items(), key=lambda item: -item[1]):
+            out.write(f"  {count:8d}  {name}\n")
+        for title, counts in (("Cumulative", cumulative_counts), ("Own time", own_counts)):
+            out.write(f"\n{title} (samples, % of samples, function):\n")
+            for key, count in sorted(counts.items(), key=lambda item: -item[1])[:PROFILE_TOP_ENTRIES]:
+                out.write(f"  {count:8d}  {100.0 * count / max(samples, 1):6.1f}%  {key}\n")
+        return out.getvalue()
+
+    def _take_mem_snapshot(self):
+        # The baseline and every later snapshot must drop the same frames, or growth compares unlike sets
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def _run_memory_profile(self, update, context):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+            self.mem_snapshot = self._take_mem_snapshot()
+            self.send_message(update, context, "\u2705 Memory tracing started. Run /profile mem again to see top allocators and growth.")
+            return
+
+        snapshot = self._take_mem_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        out = io.StringIO()
+        out.write(f"Traced memory: {current / 1024:.1f} KiB current, {peak / 1024:.1f} KiB peak\n")
+        out.write("\nTop allocators:\n")
+        for stat in snapshot.statistics("lineno")[:PROFILE_TOP_ENTRIES]:
+            out.write(f"  {stat}\n")
+        if self.mem_snapshot is not None:
+            out.write("\nGrowth since last snapshot:\n")
+            for stat in snapshot.compare_to(self.mem_snapshot, "lineno")[:PROFILE_TOP_ENTRIES]:
+                out.write(f"  {stat}\n")
+        self.mem_snapshot = snapshot
+        self._send_report(update, context, out.getvalue(), "telepwn_profile_mem.txt")
+
+    def _send_report(self, update, context, report, filename):
+        # Reports can hold logs, hashes or profiles; like send_message, only the owner's chat gets them
+        if update.effective_chat.id != int(self.options.get("chat_id")):
+            self.logger.warning(f"[TelePwn] Refused to send {filename} to chat {update.effective_chat.id}")
+            return
+        document = io.BytesIO(report.encode("utf-8"))
+        context.bot.send_document(chat_id=update.effective_chat.id, document=document, filename=filename)
+
+    def batch_command(self, agent, update, context):
+        if update.effective_chat.id != int(self.options.get("chat_id")):
+            return
+        args = [arg.lstrip("/").lower() for arg in context.args]
+        macros = self.store.get("batch.macros", {})
+        usage = f"Usage: /batch <command> [command ...]\n/batch save <name> <command> [command ...]\n/batch delete <name>\n/batch list\nCommands: {', '.join(BATCH_COMMANDS)}"
+        if not args:
+            self.send_message(update, context, usage)
+            return
+
+        if args[0] == "list":
+            if not macros:
+                self.send_message(update, context, "\u26a0 No macros saved.")
+            else:
+                self.send_message(update, context, "\ud83d\udccb Macros:\n" + "\n".join(f"{name}: {' '.join(commands)}" for name, commands in sorted(macros.items())))
+            return
+        if args[0] == "delete" and len(args) == 2:
+            if macros.pop(args[1], None) is None:
+                self.send_message(update, context, f"\u26d4 No macro named {args[1]}")
+                return
+            self.store.set("batch.macros", macros)
+            self.send_message(update, context, f"\u2705 Macro {args[1]} deleted")
+            return
+        if args[0] == "save":
+            if len(args) < 3 or not MACRO_NAME.match(args[1]) or args[1] in BATCH_COMMANDS or args[1] in ("list", "save", "delete"):
+                self.send_message(update, context, "\u26d4 Usage: /batch save <name> <command> [command ...] (name: lowercase letters, digits, _)")
+                return
+            unknown = [arg for arg in args[2:] if arg not in BATCH_COMMANDS]
+            if unknown:
+                self.send_message(update, context, f"\u26d4 Unknown command(s): {', '.join(unknown)}")
+                return
+            macros[args[1]] = args[2:]
+            self.store.set("batch.macros", macros)
+            self.send_message(update, context, f"\u2705 Macro {args[1]} saved: {' '.join(args[2:])}")
+            return
+
+        # Expand macros one level, dropping repeats
+        commands = []
+        for arg in args:
+            for command in macros.get(arg, [arg]):
+                if command not in commands:
+                    commands.append(command)
+        unknown = [command for command in commands if command not in BATCH_COMMANDS]
+        if unknown:
+            self.send_message(update, context, f"\u26d4 Unknown command(s): {', '.join(unknown)}\n{usage}")
+            return
+        if len(commands) > BATCH_MAX_COMMANDS:
+            self.send_message(update, context, f"\u26d4 At most {BATCH_MAX_COMMANDS} commands per batch.")
+            return
+
+        # The batch takes one token from each class it touches, instead of one per command
+        classes = {ACTION_CLASSES.get(BATCH_COMMANDS[c], "read") for c in commands}
+        if not all(self.throttle.allow(action_class) for action_class in sorted(classes)):
+            self.logger.info(f"[TelePwn] Throttled batch ({', '.join(sorted(classes))})")
+            self.send_message(update, context, "\u26a0 Slow down! Wait a moment.")
+            return
+
+        context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        actions = self._dispatch_table()
+        parallel = [c for c in commands if ACTION_CLASSES.get(BATCH_COMMANDS[c], "read") == "read"]
+        results = {}
+        # Handlers see no arguments, as if they were sent on their own
+        batch_args, context.args = context.args, []
+        try:
+            with ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="telepwn-batch") as pool:
+                futures = {c: pool.submit(self._batch_run, BATCH_COMMANDS[c], actions, agent, update, context) for c in parallel}
+                results.update((c, future.result()) for c, future in futures.items())
+            # Anything that changes state runs one at a time, after the reads
+            for command in commands:
+                if command not in results:
+                    results[command] = self._batch_run(BATCH_COMMANDS[command], actions, agent, update, context)
+        finally:
+            context.args = batch_args
+        # Split between whole sections, so a message never ends inside a tag or entity
+        messages, current = [], ""
+        for command in commands:
+            title = f"<b>/{command}</b>\n"
+            section = title + escape_truncated(results[command], MAX_MESSAGE_LENGTH - len(title))
+            if current and len(current) + 2 + len(section) > MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                current = section
+            else:
+                current = f"{current}\n\n{section}" if current else section
+        messages.append(current)
+        for message in messages:
+            self.send_message(update, context, message)
+
+    def _batch_run(self, action, actions, agent, update, context):
+        # Throttling is applied once by the caller, not per command. Anything beyond a plain read
+        # still joins the in-flight check under the same key /backup and the buttons use.
+        key = (action,)
+        guarded = ACTION_CLASSES.get(action, "read") != "read"
+        if guarded and not self.throttle.begin(key):
+            self.logger.info(f"[TelePwn] Duplicate {action} attached to the running job")
+            return f"\u23f3 {action} is already running."
+        try:
+            return self._captured(f"Batch action {action}", actions[action], agent, update, context)
+        finally:
+            if guarded:
+                merged = self.throttle.end(key)
+                if merged:
+                    self.logger.info(f"[TelePwn] {action} finished; merged {merged} duplicate request(s)")
+
+    def _captured(self, label, handler, *args):
+        self.capture.buffer = []
+        try:
+            handler(*args)
+        except Exception as e:
+            self.logger.error(f"[TelePwn] {label} failed: {e}")
+            self.capture.buffer.append(f"\u26d4 Error: {e}")
+        finally:
+            output, self.capture.buffer = self.capture.buffer, None
+        return "\n".join(output) or "\u2705 Done"
+
     def pwngrid_actions(self, agent, update, context):
         if not context.args:
             self.send_message(update, context, "Usage:\n/pwngrid send <message>\n/pwngrid clear\nExample: /pwngrid send Hello from TelePwn")
@@ -936,9 +3662,11 @@ class TelePwn(plugins.Plugin):
                     return
                 message = " ".join(context.args[1:])
                 subprocess.run(["pwngrid", "--send", message], check=True)
+                self.invalidate_inbox()
                 self.send_message(update, context, f"\u2705 Sent to Pwngrid: {message}")
             elif action == "clear":
                 subprocess.run(["pwngrid", "--clear"], check=True)
+                self.invalidate_inbox(cleared=True)
                 self.send_message(update, context, "\u2705 Pwngrid inbox cleared.")
             else:
                 self.send_message(update, context, "Invalid action. Use 'send' or 'clear'.")
@@ -946,18 +3674,31 @@ class TelePwn(plugins.Plugin):
             self.send_message(update, context, f"\u26d4 Pwngrid action failed: {e}")
 
     def file_manager(self, agent, update, context):
+        # Captures, hashes and uploads are owner-only, whatever the subcommand
+        if update.effective_chat.id != int(self.options.get("chat_id")):
+            return
         if not context.args:
-            self.send_message(update, context, "Usage:\n/files list\n/files download <filename>\n/files upload\nExample: /files download handshake.pcap")
+            self.send_message(update, context, "Usage:\n/files list\n/files download <filename>\n/files upload\n/files hashes [since]\n/files dedupe\nExample: /files download handshake.pcap")
             return
 
         action = context.args[0].lower()
         try:
             if action == "list":
-                files = [f for f in os.listdir(HANDSHAKE_DIR) if os.path.isfile(os.path.join(HANDSHAKE_DIR, f))]
+                files = sorted(f for f in os.listdir(HANDSHAKE_DIR) if os.path.isfile(os.path.join(HANDSHAKE_DIR, f)))
                 if not files:
                     self.send_message(update, context, "\u26a0 No files found in handshake directory.")
                     return
-                msg = "Files in handshake directory:\n" + "\n".join([f"- {f}" for f in files])
+                catalog = self.captures.refresh()
+                lines = []
+                for f in files:
+                    row = catalog.get(os.path.join(HANDSHAKE_DIR, f))
+                    if not row:
+                        lines.append(f"- {html.escape(f)}")
+                    elif row["essid"] or row["bssid"] or row["error"]:
+                        lines.append(f"{CAPTURE_STATUS[row['status']]} {html.escape(f)} - {self._describe_capture(row)}")
+                    else:
+                        lines.append(f"{CAPTURE_STATUS[row['status']]} {html.escape(f)}")
+                msg = "Files in handshake directory:\n" + "\n".join(lines)
                 self.send_message(update, context, msg)
             elif action == "download":
                 if len(context.args) < 2:
@@ -971,25 +3712,136 @@ class TelePwn(plugins.Plugin):
                 with open(file_path, "rb") as f:
                     context.bot.send_document(chat_id=update.effective_chat.id, document=f)
                 self.send_message(update, context, f"\u2705 Sent file: {filename}")
+            elif action == "dedupe":
+                self.dedupe_report(update, context)
+            elif action == "hashes":
+                self.export_hashes(update, context, context.args[1] if len(context.args) > 1 else None)
             elif action == "upload":
-                # Set the user's state to "waiting for upload"
+                if len(context.args) > 1 and context.args[1].lower() == "done":
+                    self.finish_upload(update, context)
+                    return
+                # Open an upload session; it stays open while documents keep arriving
                 chat_id = update.effective_chat.id
-                self.user_states[chat_id] = "waiting_for_upload"
-                self.send_message(update, context, "Please send the handshake file to upload to /home/pi/handshakes/.\nOnly .pcap or .pcapng files are allowed.")
+                self.pending.discard(chat_id, "upload")
+                self.pending.put(chat_id, "upload", {"accepted": [], "duplicates": [], "rejected": [], "hashes": set()}, ttl=UPLOAD_TTL_SECONDS, single_use=False)
+                keyboard = [[InlineKeyboardButton("\u2705 Done", callback_data=f"t:{self.pending.put(chat_id, 'upload_done', ttl=UPLOAD_TTL_SECONDS * 12)}")]]
+                self.send_message(update, context, f"Send handshake files to upload to {HANDSHAKE_DIR}.\nAllowed: .pcap, .pcapng, .cap, or .zip/.tar.gz archives of them. Send as many as you like, then press Done (or /files upload done).", keyboard)
             else:
-                self.send_message(update, context, "Invalid action. Use 'list', 'download', or 'upload'.")
+                self.send_message(update, context, "Invalid action. Use 'list', 'download', 'upload', 'hashes' or 'dedupe'.")
         except Exception as e:
             self.send_message(update, context, f"\u26d4 File action failed: {e}")
 
+    def dedupe_report(self, update, context):
+        groups = self.captures.duplicates()
+        if not groups:
+            self.send_message(update, context, "\u2705 No duplicate captures found.")
+            return
+        lines = []
+        copies = reclaimable = 0
+        for group in groups:
+            keeper = group[0][1][0]
+            names = []
+            for links, rows in group[1:]:
+                copies += len(rows)
+                # Space only comes back if no link outside the handshake directory keeps the inode alive
+                if links <= len(rows):
+                    reclaimable += rows[0]["size"]
+                names.extend(os.path.basename(row["path"]) for row in rows)
+            lines.append(f"{html.escape(os.path.basename(keeper['path']))} = {html.escape(', '.join(names))}")
+        header = f"\u267b\ufe0f {copies} duplicate capture(s) in {len(groups)} group(s), {round(reclaimable / 1024, 1)} KB reclaimable.\nThe oldest file in each group is kept:"
+        chat_id = update.effective_chat.id
+        keyboard = [
+            [InlineKeyboardButton("\ud83d\udd17 Hardlink duplicates", callback_data=f"t:{self.pending.put(chat_id, 'dedupe_apply', 'link')}")],
+            [InlineKeyboardButton("\ud83d\uddd1 Remove duplicates", callback_data=f"t:{self.pending.put(chat_id, 'dedupe_apply', 'remove')}")],
+            [InlineKeyboardButton("\u274c Cancel", callback_data="cancel")],
+        ]
+        self.send_message(update, context, header + "\n" + "\n".join(lines), keyboard)
+
+    def dedupe_apply(self, update, context, mode):
+        # Regroup now rather than trusting the report, and compare bytes before touching anything
+        done = 0
+        freed = 0
+        errors = []
+        for group in self.captures.duplicates():
+            keeper = group[0][1][0]["path"]
+            for links, rows in group[1:]:
+                # All names of one inode hold the same bytes, so one comparison covers them
+                try:
+                    if not filecmp.cmp(keeper, rows[0]["path"], shallow=False):
+                        continue
+                except OSError as e:
+                    errors.append(f"{os.path.basename(rows[0]['path'])}: {e}")
+                    continue
+                unlinked = 0
+                for row in rows:
+                    path = row["path"]
+                    partial = f"{path}.partial"
+                    try:
+                        # Already the same inode (linked since the report); nothing to free
+                        if os.path.samefile(keeper, path):
+                            continue
+                        if mode == "link":
+                            os.link(keeper, partial)
+                            os.replace(partial, path)
+                        else:
+                            os.remove(path)
+                        done += 1
+                        unlinked += 1
+                    except OSError as e:
+                        errors.append(f"{os.path.basename(path)}: {e}")
+                    finally:
+                        # A failed replace must not leave the extra link behind
+                        if os.path.lexists(partial):
+                            os.remove(partial)
+                # The data is only released once its last link is gone
+                if unlinked >= links:
+                    freed += rows[0]["size"]
+        self.captures.refresh()
+        verb = "Hardlinked" if mode == "link" else "Removed"
+        self.logger.info(f"[TelePwn] {verb} {done} duplicate capture(s), {freed} bytes")
+        msg = f"\u2705 {verb} {done} duplicate capture(s), {round(freed / 1024, 1)} KB freed."
+        if errors:
+            msg += "\n\u26a0 Failed:\n" + html.escape("\n".join(errors))
+        self.send_message(update, context, msg)
+
+    def export_hashes(self, update, context, since=None):
+        try:
+            since_ns = int(parse_time_arg(since) * 1_000_000_000) if since else 0
+        except ValueError as e:
+            self.send_message(update, context, f"\u26d4 {e}\nTimes: 30m, 2h, 1d, today, yesterday, HH:MM, YYYY-MM-DD")
+            return
+        context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_document")
+        # Only captures that are new or changed since the last export get parsed
+        self.captures.refresh()
+        seen = set()
+        out = io.StringIO()
+        counts = {"01": 0, "02": 0}
+        files = 0
+        for _, lines in self.store.capture_hashes(since_ns):
+            fresh = [line for line in lines if line not in seen]
+            if not fresh:
+                continue
+            files += 1
+            for line in fresh:
+                seen.add(line)
+                counts[line[4:6]] += 1
+                out.write(line + "\n")
+        if not seen:
+            self.send_message(update, context, "\u26a0 No crackable captures found" + (f" since {since}." if since else "."))
+            return
+        self._send_report(update, context, out.getvalue(), f"telepwn_{datetime.now():%Y%m%d_%H%M%S}.22000")
+        self.send_message(update, context, f"\u2705 {len(seen)} hashes ({counts['02']} EAPOL, {counts['01']} PMKID) from {files} capture(s). Crack with: hashcat -m 22000")
+
     def handle_document_upload(self, agent, update, context):
         chat_id = update.effective_chat.id
-        # Check if the user is in "upload mode"
-        if chat_id not in self.user_states or self.user_states[chat_id] != "waiting_for_upload":
+        # Documents are only accepted inside an open /files upload session
+        token = self.pending.find(chat_id, "upload")
+        pending = self.pending.take(chat_id, token) if token else None
+        if pending is None:
             self.send_message(update, context, "Please use /files upload to start the upload process.")
             return
-
-        # Clear the user's state
-        del self.user_states[chat_id]
+        self.pending.touch(chat_id, token, UPLOAD_TTL_SECONDS)
+        session = pending[1]
 
         # Check if the message contains a document
         if not update.message.document:
@@ -997,36 +3849,143 @@ class TelePwn(plugins.Plugin):
             return
 
         document = update.message.document
-        file_name = document.file_name
-
-        # Validate file type (only allow .pcap or .pcapng for handshakes)
-        if not (file_name.endswith('.pcap') or file_name.endswith('.pcapng')):
-            self.send_message(update, context, "\u26d4 Only .pcap or .pcapng files are allowed for handshakes.")
+        file_name = document.file_name or "upload"
+        lower = file_name.lower()
+        if not lower.endswith(CAPTURE_EXTENSIONS + UPLOAD_ARCHIVES):
+            session["rejected"].append((file_name, "not a capture or archive"))
+            return
+        if document.file_size and document.file_size > UPLOAD_MAX_BYTES:
+            session["rejected"].append((file_name, "larger than the 20 MB bot download limit"))
             return
 
+        with self.upload_lock:
+            try:
+                known = {row["sha256"] for row in self.captures.refresh().values()} | session["hashes"]
+                file = context.bot.get_file(document.file_id)
+                response = requests.get(file.file_path, stream=True, timeout=60)
+                response.raise_for_status()
+                response.raw.decode_content = True
+                if lower.endswith(CAPTURE_EXTENSIONS):
+                    self._ingest_capture(response.raw, file_name, session, known)
+                elif lower.endswith(".zip"):
+                    # zip needs random access; the download is capped at 20 MB and kept in memory
+                    buffer = io.BytesIO()
+                    self._copy_capped(response.raw, buffer, UPLOAD_MAX_BYTES)
+                    with zipfile.ZipFile(buffer) as archive:
+                        entries = (
+                            (info.filename, lambda info=info: archive.open(info), info.file_size)
+                            for info in archive.infolist() if not info.is_dir()
+                        )
+                        self._ingest_archive(entries, file_name, session, known)
+                else:
+                    # tar streams straight from the response, member by member
+                    with tarfile.open(fileobj=response.raw, mode="r|*") as archive:
+                        entries = (
+                            (member.name, lambda member=member: archive.extractfile(member), member.size)
+                            for member in archive if member.isfile()
+                        )
+                        self._ingest_archive(entries, file_name, session, known)
+                response.close()
+            except (requests.RequestException, zipfile.BadZipFile, tarfile.TarError, OSError, ValueError, RuntimeError, NotImplementedError) as e:
+                session["rejected"].append((file_name, str(e)))
+                self.logger.error(f"[TelePwn] Failed to upload file {file_name}: {e}")
+
+    def _ingest_archive(self, entries, archive_name, session, known):
+        count = total = 0
+        for name, opener, size in entries:
+            label = f"{archive_name}/{name}"
+            if count >= UPLOAD_MAX_ENTRIES or total + size > UPLOAD_MAX_EXTRACTED_BYTES:
+                session["rejected"].append((label, "archive limits reached"))
+                break
+            count += 1
+            total += size
+            try:
+                with opener() as stream:
+                    self._ingest_capture(stream, name, session, known, label)
+            except (RuntimeError, NotImplementedError, zipfile.BadZipFile, tarfile.TarError, EOFError, OSError, ValueError) as e:
+                # Encrypted, unsupported compression, corrupt or unwritable member: skip it, keep the rest
+                session["rejected"].append((label, str(e) or type(e).__name__))
+
+    def _ingest_capture(self, stream, name, session, known, label=None):
+        label = label or name
+        name = os.path.basename(name.replace("\\", "/"))
+        if not name or name.startswith(".") or not name.lower().endswith(CAPTURE_EXTENSIONS):
+            session["rejected"].append((label, "not a .pcap/.pcapng/.cap file"))
+            return
+        # Check the magic bytes before anything touches the disk
+        head = stream.read(4)
+        if head not in PCAP_BYTE_ORDER and head != b"\x0a\x0d\x0d\x0a":
+            session["rejected"].append((label, "not a pcap or pcapng file"))
+            return
+        digest = hashlib.sha256(head)
+        fd, partial = tempfile.mkstemp(dir=HANDSHAKE_DIR, prefix=".upload-", suffix=".partial")
         try:
-            # Download the file
-            file = context.bot.get_file(document.file_id)
-            file_path = os.path.join(HANDSHAKE_DIR, file_name)
-
-            # Check if file already exists
-            if os.path.exists(file_path):
-                self.send_message(update, context, f"\u26d4 File {file_name} already exists in {HANDSHAKE_DIR}.")
+            with os.fdopen(fd, "wb") as f:
+                f.write(head)
+                self._copy_capped(stream, f, UPLOAD_MAX_ENTRY_BYTES - len(head), digest)
+                f.flush()
+                os.fsync(f.fileno())
+            sha256 = digest.hexdigest()
+            if sha256 in known:
+                session["duplicates"].append(label)
                 return
-
-            # Download and save the file
-            file.download(file_path)
-
-            # Set appropriate permissions (readable/writable by pi user)
-            os.chmod(file_path, 0o644)
-            os.chown(file_path, 1000, 1000)  # pi user and group (uid 1000, gid 1000)
-
-            # Confirm success
-            self.send_message(update, context, f"\u2705 File {file_name} uploaded to {HANDSHAKE_DIR}.")
-            self.logger.info(f"[TelePwn] Uploaded file {file_name} to {HANDSHAKE_DIR}")
-        except Exception as e:
-            self.send_message(update, context, f"\u26d4 Failed to upload file: {str(e)}")
-            self.logger.error(f"[TelePwn] Failed to upload file {file_name}: {e}")
+            os.chmod(partial, 0o644)
+            os.chown(partial, 1000, 1000)  # pi user and group (uid 1000, gid 1000)
+            try:
+                # link() never replaces an existing capture, unlike rename()
+                os.link(partial, os.path.join(HANDSHAKE_DIR, name))
+            except FileExistsError:
+                session["rejected"].append((label, f"a different {name} already exists"))
+                return
+            known.add(sha256)
+            session["hashes"].add(sha256)
+            session["accepted"].append(name)
+            self.logger.info(f"[TelePwn] Uploaded file {name} to {HANDSHAKE_DIR}")
+        except ValueError as e:
+            session["rejected"].append((label, str(e)))
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def _copy_capped(self, src, dst, limit, digest=None):
+        copied = 0
+        for chunk in iter(lambda: src.read(HASH_CHUNK_SIZE), b""):
+            copied += len(chunk)
+            if copied > limit:
+                raise ValueError(f"larger than {limit // (1024 * 1024)} MB")
+            if digest:
+                digest.update(chunk)
+            dst.write(chunk)
+        return copied
+
+    def finish_upload(self, update, context):
+        chat_id = update.effective_chat.id
+        token = self.pending.find(chat_id, "upload")
+        pending = self.pending.take(chat_id, token) if token else None
+        self.pending.discard(chat_id, "upload")
+        self.pending.discard(chat_id, "upload_done")
+        if pending is None:
+            self.send_message(update, context, "\u26a0 No upload session is open. Use /files upload to start one.")
+            return
+        with self.upload_lock:
+            session = pending[1]
+            catalog = self.captures.refresh()
+        lines = [f"\ud83d\udce5 Upload summary: {len(session['accepted'])} accepted, {len(session['duplicates'])} duplicate, {len(session['rejected'])} rejected"]
+        if session["accepted"]:
+            lines.append("\nAccepted:")
+            for name in session["accepted"][:UPLOAD_SUMMARY_LIST]:
+                row = catalog.get(os.path.join(HANDSHAKE_DIR, name))
+                lines.append(f"{CAPTURE_STATUS[row['status']]} {html.escape(name)}" if row else f"- {html.escape(name)}")
+        if session["duplicates"]:
+            lines.append("\nDuplicates (already on the device):")
+            lines.extend(f"\u267b\ufe0f {html.escape(name)}" for name in session["duplicates"][:UPLOAD_SUMMARY_LIST])
+        if session["rejected"]:
+            lines.append("\nRejected:")
+            lines.extend(f"\u26d4 {html.escape(name)}: {html.escape(reason)}" for name, reason in session["rejected"][:UPLOAD_SUMMARY_LIST])
+        for key in ("accepted", "duplicates", "rejected"):
+            if len(session[key]) > UPLOAD_SUMMARY_LIST:
+                lines.append(f"...and {len(session[key]) - UPLOAD_SUMMARY_LIST} more {key}")
+        self.send_message(update, context, "\n".join(lines))
 
     def schedule_manager(self, agent, update, context):
         if not context.args:
@@ -1055,9 +4014,8 @@ class TelePwn(plugins.Plugin):
                 if interval <= 0:
                     self.send_message(update, context, "Interval must be a positive number.")
                     return
-                task_id = str(len(self.schedules) + 1)
+                task_id = self.store.add_schedule(task_action, interval)
                 self.schedules[task_id] = {"action": task_action, "interval": interval}
-                self._save_schedules()
                 self.stop_scheduler()
                 self.start_scheduler()
                 self.send_message(update, context, f"\u2705 Scheduled {task_action} every {interval} hours (ID: {task_id})")
@@ -1069,8 +4027,8 @@ class TelePwn(plugins.Plugin):
                 if task_id not in self.schedules:
                     self.send_message(update, context, f"\u26d4 Task ID {task_id} not found.")
                     return
+                self.store.remove_schedule(task_id)
                 del self.schedules[task_id]
-                self._save_schedules()
                 self.stop_scheduler()
                 self.start_scheduler()
                 self.send_message(update, context, f"\u2705 Removed scheduled task (ID: {task_id})")
@@ -1085,8 +4043,9 @@ class TelePwn(plugins.Plugin):
             return
 
         command = " ".join(context.args)
+        token = self.pending.put(update.effective_chat.id, "confirm_shell", command)
         keyboard = [
-            [InlineKeyboardButton("✅ Confirm", callback_data=f"confirm_shell_{command}")],
+            [InlineKeyboardButton("✅ Confirm", callback_data=f"t:{token}")],
             [InlineKeyboardButton("❌ Cancel", callback_data="cancel")],
         ]
         self.send_message(update, context, f"\u26a0\ufe0f Confirm running shell command?\nCommand: {command}", keyboard)
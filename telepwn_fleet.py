@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# Fleet coordinator for TelePwn.
+#
+# Lets several pwnagotchis share one Telegram bot. The unit that owns the bot sends
+# commands here, and every unit (including that one) long-polls for jobs and posts
+# the results back. JSON over HTTP, stdlib only, so it runs on a unit or on any
+# small server:
+#
+#   POST /poll      {"unit": "pwn2", "results": [{"id": "...", "ok": true, "result": {...}}]}
+#                -> {"jobs": [{"id": "...", "command": "stats"}]}
+#   POST /dispatch  {"command": "stats", "targets": ["all"], "timeout": 15}
+#                -> {"results": {"pwn1": {"ok": true, "result": {...}}, "pwn2": {"ok": false, "error": "timeout"}}}
+#   GET  /units     -> {"units": {"pwn1": 3.2}}   (seconds since each unit last polled)
+#
+# Every request must carry the shared secret in the X-Fleet-Token header. Units
+# only answer a fixed set of read-only commands, so the coordinator cannot make
+# them run anything else. For local testing:
+#
+#   python3 telepwn_fleet.py --listen 127.0.0.1:8765 --token test
+import re
+import sys
+import hmac
+import json
+import logging
+import secrets
+import argparse
+import threading
+from time import monotonic
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FLEET_PORT = 8765
+POLL_TIMEOUT = 25
+UNIT_STALE_SECONDS = 90
+MAX_DISPATCH_TIMEOUT = 60
+MAX_REQUEST_BYTES = 256 * 1024
+UNIT_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,31}$")
+
+
+class FleetError(Exception):
+    pass
+
+
+class FleetCoordinator:
+    def __init__(self, token, poll_timeout=POLL_TIMEOUT, stale=UNIT_STALE_SECONDS):
+        self.logger = logging.getLogger("TelePwnFleet")
+        self.token = token
+        self.poll_timeout = poll_timeout
+        self.stale = stale
+        self.cond = threading.Condition()
+        self.units = {}  # name -> {"seen": monotonic, "queue": deque of job ids}
+        self.jobs = {}  # id -> {"unit", "command", "result"}
+        self.server = None
+
+    def poll(self, unit, results=(), timeout=None):
+        if not isinstance(unit, str) or not UNIT_NAME.match(unit):
+            raise FleetError(f"invalid unit name: {unit!r}")
+        timeout = self.poll_timeout if timeout is None else min(timeout, self.poll_timeout)
+        with self.cond:
+            state = self.units.setdefault(unit, {"seen": 0, "queue": deque()})
+            if not state["seen"]:
+                self.logger.info(f"[TelePwnFleet] Unit {unit} registered")
+            state["seen"] = monotonic()
+            for result in results:
+                job = self.jobs.get(result.get("id"))
+                if job and job["unit"] == unit and job["result"] is None:
+                    if result.get("ok"):
+                        job["result"] = {"ok": True, "result": result.get("result")}
+                    else:
+                        job["result"] = {"ok": False, "error": str(result.get("error", "failed"))}
+            if results:
+                self.cond.notify_all()
+            deadline = monotonic() + timeout
+            while not state["queue"]:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            jobs = [{"id": job_id, "command": self.jobs[job_id]["command"]} for job_id in state["queue"] if job_id in self.jobs]
+            state["queue"].clear()
+            state["seen"] = monotonic()
+        return jobs
+
+    def dispatch(self, command, targets, timeout):
+        if not isinstance(command, str) or not command:
+            raise FleetError("command required")
+        if not isinstance(targets, list) or not targets:
+            raise FleetError("targets must be a non-empty list")
+        timeout = max(1, min(float(timeout), MAX_DISPATCH_TIMEOUT))
+        results = {}
+        pending = {}
+        with self.cond:
+            now = monotonic()
+            live = sorted(name for name, state in self.units.items() if now - state["seen"] < self.stale)
+            chosen = live if "all" in targets else targets
+            for name in chosen:
+                if name not in live:
+                    results[name] = {"ok": False, "error": "offline" if name in self.units else "unknown unit"}
+                    continue
+                job_id = secrets.token_hex(8)
+                self.jobs[job_id] = {"unit": name, "command": command, "result": None}
+                self.units[name]["queue"].append(job_id)
+                pending[name] = job_id
+            self.cond.notify_all()
+            # Units work in parallel; wait for all of them, up to the timeout
+            deadline = monotonic() + timeout
+            while any(self.jobs[job_id]["result"] is None for job_id in pending.values()):
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            for name, job_id in pending.items():
+                job = self.jobs.pop(job_id)
+                results[name] = job["result"] or {"ok": False, "error": "timeout"}
+                if job_id in self.units[name]["queue"]:
+                    self.units[name]["queue"].remove(job_id)
+        self.logger.info(f"[TelePwnFleet] {command} -> {', '.join(sorted(results)) or 'no units'}")
+        return results
+
+    def unit_ages(self):
+        with self.cond:
+            now = monotonic()
+            return {name: round(now - state["seen"], 1) for name, state in self.units.items()}
+
+    def handle(self, method, path, request):
+        if method == "POST" and path == "/poll":
+            return {"jobs": self.poll(request.get("unit"), request.get("results") or [], request.get("timeout"))}
+        if method == "POST" and path == "/dispatch":
+            return {"results": self.dispatch(request.get("command"), request.get("targets"), request.get("timeout", 15))}
+        if method == "GET" and path == "/units":
+            return {"units": self.unit_ages()}
+        raise FleetError(f"not found: {method} {path}")
+
+    def serve_forever(self, host="0.0.0.0", port=FLEET_PORT):
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.respond("GET")
+
+            def do_POST(self):
+                self.respond("POST")
+
+            def respond(self, method):
+                if not hmac.compare_digest(self.headers.get("X-Fleet-Token", ""), coordinator.token):
+                    return self.reply(403, {"error": "bad token"})
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    if length > MAX_REQUEST_BYTES:
+                        raise FleetError("request too large")
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                    if not isinstance(request, dict):
+                        raise FleetError("request must be an object")
+                    self.reply(200, coordinator.handle(method, self.path, request))
+                except (FleetError, ValueError, TypeError) as e:
+                    self.reply(400, {"error": str(e)})
+
+            def reply(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, fmt, *args):
+                coordinator.logger.debug(f"[TelePwnFleet] {self.address_string()} {fmt % args}")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.logger.info(f"[TelePwnFleet] Listening on {host}:{self.server.server_address[1]}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def shutdown(self):
+        if self.server:
+            self.server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TelePwn fleet coordinator")
+    parser.add_argument("--listen", default=f"0.0.0.0:{FLEET_PORT}", help="host:port to listen on")
+    parser.add_argument("--token", required=True, help="Shared secret the units are configured with")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    host, _, port = args.listen.rpartition(":")
+    coordinator = FleetCoordinator(args.token)
+    try:
+        coordinator.serve_forever(host or "0.0.0.0", int(port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# Privileged helper for TelePwn.
+#
+# Runs as root and listens on a Unix socket so the plugin can issue one request
+# per operation instead of forking chains of sudo processes. Only the fixed set
+# of operations below is accepted. Requests and responses are one JSON object
+# per line:
+#
+#   {"op": "flag", "args": {"mode": "manual"}}
+#   {"ok": true, "result": {...}}  or  {"ok": false, "error": "..."}
+#
+# For local testing it can run unprivileged against a temp root:
+#
+#   python3 telepwn_helper.py --root /tmp/pwnroot --socket /tmp/pwnroot/helper.sock --dry-run
+import os
+import sys
+import json
+import signal
+import logging
+import tarfile
+import argparse
+import subprocess
+import socketserver
+
+HELPER_SOCKET = "/run/telepwn-helper.sock"
+MODE_FLAGS = {
+    "auto": "/root/.pwnagotchi-auto",
+    "manual": "/root/.pwnagotchi-manual",
+}
+SERVICES = ("pwnagotchi", "bettercap", "pwngrid-peer")
+SERVICE_ACTIONS = ("start", "stop", "restart")
+POWER_ACTIONS = ("reboot", "poweroff")
+SIGNALS = ("USR1", "USR2", "HUP", "TERM")
+ARCHIVE_DIR = "/home/pi/"
+ARCHIVE_PATHS = (
+    "/root/settings.yaml",
+    "/root/client_secrets.json",
+    "/home/pi/handshakes/",
+    "/root/.api-report.json",
+    "/root/.ssh",
+    "/root/.bashrc",
+    "/root/.profile",
+    "/root/peers",
+    "/etc/pwnagotchi/",
+    "/usr/local/share/pwnagotchi/custom-plugins",
+    "/etc/ssh/",
+    "/home/pi/.bashrc",
+    "/home/pi/.profile",
+    "/root/.auto-update",
+    "/home/pi/.wpa_sec_Uploads",
+)
+MAX_REQUEST_BYTES = 64 * 1024
+
+
+class HelperError(Exception):
+    pass
+
+
+class PrivilegedHelper:
+    def __init__(self, socket_path=HELPER_SOCKET, root="/", dry_run=False, runner=subprocess.run):
+        self.logger = logging.getLogger("TelePwnHelper")
+        self.socket_path = socket_path
+        self.root = os.path.realpath(root)
+        self.dry_run = dry_run
+        self.runner = runner
+        self.server = None
+        self.operations = {
+            "flag": self.op_flag,
+            "sync": self.op_sync,
+            "service": self.op_service,
+            "signal": self.op_signal,
+            "archive": self.op_archive,
+        }
+
+    def path(self, path):
+        # Map an absolute device path into the configured root
+        resolved = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        if resolved != self.root and not resolved.startswith(self.root.rstrip("/") + "/"):
+            raise HelperError(f"path escapes root: {path}")
+        return resolved
+
+    def handle(self, request):
+        try:
+            op = request.get("op")
+            if op not in self.operations:
+                raise HelperError(f"operation not allowed: {op}")
+            args = request.get("args") or {}
+            if not isinstance(args, dict):
+                raise HelperError("args must be an object")
+            result = self.operations[op](**args)
+            self.logger.info(f"[TelePwnHelper] {op} {args} -> ok")
+            return {"ok": True, "result": result}
+        except TypeError as e:
+            return {"ok": False, "error": f"bad arguments: {e}"}
+        except (HelperError, OSError, subprocess.CalledProcessError, tarfile.TarError) as e:
+            self.logger.error(f"[TelePwnHelper] {request.get('op')} failed: {e}")
+            return {"ok": False, "error": str(e)}
+
+    def op_flag(self, mode):
+        if mode not in MODE_FLAGS:
+            raise HelperError(f"unknown mode: {mode}")
+        for name, flag in MODE_FLAGS.items():
+            path = self.path(flag)
+            if name == mode:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "a"):
+                    os.utime(path, None)
+            elif os.path.exists(path):
+                os.remove(path)
+        return {"mode": mode}
+
+    def op_sync(self):
+        os.sync()
+        return {}
+
+    def op_service(self, action, name=None):
+        if action in POWER_ACTIONS:
+            command = ["systemctl", action]
+        elif action in SERVICE_ACTIONS and name in SERVICES:
+            command = ["systemctl", action, name]
+        else:
+            raise HelperError(f"service action not allowed: {action} {name or ''}".strip())
+        return self.run(command)
+
+    def op_signal(self, signal_name="USR1"):
+        if signal_name not in SIGNALS:
+            raise HelperError(f"signal not allowed: {signal_name}")
+        pids = self.pwnagotchi_pids()
+        if not pids:
+            raise HelperError("pwnagotchi is not running")
+        if self.dry_run:
+            return {"dry_run": True, "signal": signal_name, "pids": pids}
+        for pid in pids:
+            os.kill(pid, getattr(signal, f"SIG{signal_name}"))
+        return {"signal": signal_name, "pids": pids}
+
+    def op_archive(self, output, paths=None):
+        if not output.startswith(ARCHIVE_DIR) or not output.endswith(".tar.gz") or "/../" in output:
+            raise HelperError(f"archive output not allowed: {output}")
+        paths = list(paths) if paths else list(ARCHIVE_PATHS)
+        rejected = [p for p in paths if p not in ARCHIVE_PATHS]
+        if rejected:
+            raise HelperError(f"archive paths not allowed: {', '.join(rejected)}")
+        existing = [p for p in paths if os.path.exists(self.path(p))]
+        if not existing:
+            raise HelperError("no files found to archive")
+        target = self.path(output)
+        partial = f"{target}.partial"
+        with tarfile.open(partial, "w:gz") as tar:
+            for path in existing:
+                tar.add(self.path(path), arcname=path.strip("/"))
+        os.replace(partial, target)
+        # The plugin reads the archive back to upload it
+        os.chmod(target, 0o644)
+        return {"output": output, "paths": existing, "size": os.path.getsize(target)}
+
+    def pwnagotchi_pids(self):
+        pids = []
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit() or int(entry) == os.getpid():
+                continue
+            try:
+                with open(f"/proc/{entry}/comm", "r", encoding="utf-8") as f:
+                    if f.read().strip() == "pwnagotchi":
+                        pids.append(int(entry))
+            except OSError:
+                continue
+        return pids
+
+    def run(self, command):
+        if self.dry_run:
+            self.logger.info(f"[TelePwnHelper] dry run: {command}")
+            return {"dry_run": True, "command": command}
+        self.runner(command, check=True, capture_output=True, text=True)
+        return {"command": command}
+
+    def serve_forever(self):
+        helper = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    line = self.rfile.readline(MAX_REQUEST_BYTES)
+                    if not line:
+                        return
+                    try:
+                        request = json.loads(line)
+                        if not isinstance(request, dict):
+                            raise ValueError("request must be an object")
+                        response = helper.handle(request)
+                    except ValueError as e:
+                        response = {"ok": False, "error": f"invalid request: {e}"}
+                    self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.server.daemon_threads = True
+        os.chmod(self.socket_path, 0o660)
+        self.logger.info(f"[TelePwnHelper] Listening on {self.socket_path} (root={self.root}, dry_run={self.dry_run})")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def shutdown(self):
+        if self.server:
+            self.server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TelePwn privileged helper")
+    parser.add_argument("--socket", default=HELPER_SOCKET, help="Unix socket path")
+    parser.add_argument("--root", default="/", help="Filesystem root for flag files and archives")
+    parser.add_argument("--dry-run", action="store_true", help="Log service and signal operations instead of running them")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    helper = PrivilegedHelper(args.socket, args.root, args.dry_run)
+    try:
+        helper.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import telepwn_helper  # noqa: E402
+
+
+class PrivilegedHelperTest(unittest.TestCase):
+    # Runs the helper unprivileged against a temp root, the way the header comment describes
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.socket_path = os.path.join(self.root, "helper.sock")
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "telepwn_helper.py"), "--root", self.root, "--socket", self.socket_path, "--dry-run"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while not os.path.exists(self.socket_path):
+            if time.monotonic() > deadline or self.process.poll() is not None:
+                self.fail("helper did not start")
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+        self.tmp.cleanup()
+
+    def call(self, op, **args):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(10)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps({"op": op, "args": args}).encode("utf-8") + b"\n")
+            data = b""
+            while not data.endswith(b"\n"):
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        return json.loads(data)
+
+    def test_flag_files_stay_inside_root(self):
+        response = self.call("flag", mode="manual")
+        self.assertTrue(response["ok"], response)
+        self.assertTrue(os.path.exists(os.path.join(self.root, "root/.pwnagotchi-manual")))
+        self.assertTrue(self.call("flag", mode="auto")["ok"])
+        self.assertTrue(os.path.exists(os.path.join(self.root, "root/.pwnagotchi-auto")))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "root/.pwnagotchi-manual")))
+
+    def test_allow_list(self):
+        rejected = [
+            ("exec", {"command": "id"}),
+            ("flag", {"mode": "../../etc/passwd"}),
+            ("service", {"action": "restart", "name": "sshd"}),
+            ("service", {"action": "enable", "name": "pwnagotchi"}),
+            ("signal", {"signal_name": "KILL"}),
+            ("archive", {"output": "/tmp/out.tar.gz"}),
+            ("archive", {"output": "/home/pi/../../etc/x.tar.gz"}),
+            ("archive", {"output": "/home/pi/out.tar.gz", "paths": ["/etc/shadow"]}),
+            ("flag", {"mode": "auto", "extra": 1}),
+        ]
+        for op, args in rejected:
+            with self.subTest(op=op, args=args):
+                response = self.call(op, **args)
+                self.assertFalse(response["ok"], response)
+
+    def test_service_is_dry_run(self):
+        response = self.call("service", action="restart", name="pwnagotchi")
+        self.assertTrue(response["ok"], response)
+        self.assertEqual(response["result"], {"dry_run": True, "command": ["systemctl", "restart", "pwnagotchi"]})
+
+    def test_archive_inside_root(self):
+        os.makedirs(os.path.join(self.root, "home/pi/handshakes"))
+        with open(os.path.join(self.root, "home/pi/handshakes/a.pcap"), "wb") as f:
+            f.write(b"\xd4\xc3\xb2\xa1")
+        response = self.call("archive", output="/home/pi/backup.tar.gz", paths=["/home/pi/handshakes/"])
+        self.assertTrue(response["ok"], response)
+        self.assertTrue(os.path.exists(os.path.join(self.root, "home/pi/backup.tar.gz")))
+
+
+class PathContainmentTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.helper = telepwn_helper.PrivilegedHelper(root=self.tmp.name, dry_run=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_paths_map_into_root(self):
+        root = os.path.realpath(self.tmp.name)
+        self.assertEqual(self.helper.path("/root/.pwnagotchi-auto"), os.path.join(root, "root/.pwnagotchi-auto"))
+        self.assertEqual(self.helper.path("/"), root)
+
+    def test_escapes_are_rejected(self):
+        os.symlink("/etc", os.path.join(self.tmp.name, "link"))
+        for path in ("/../../etc/passwd", "/root/../../../etc", "/link/passwd"):
+            with self.subTest(path=path):
+                with self.assertRaises(telepwn_helper.HelperError):
+                    self.helper.path(path)
+
+
+if __name__ == "__main__":
+    unittest.main()